@@ -0,0 +1,271 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.user_manager import UserManager, user_manager
+
+logger = logging.getLogger(__name__)
+
+# Telegram пропускает около 30 сообщений в секунду на бота — держимся ниже
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", "5"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Получатели читаются из базы страницами, после каждой сохраняется курсор
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_RETRIES = 5
+PROGRESS_INTERVAL = 5.0
+
+SENT, FAILED, BLOCKED = 'sent', 'failed', 'blocked'
+
+
+class TokenBucket:
+    """Ведро токенов с подстройкой под RetryAfter.
+
+    На RetryAfter все отправки замирают на указанное время, а скорость
+    падает вдвое; каждая успешная отправка понемногу возвращает её к max_rate.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, burst: int = BROADCAST_BURST):
+        self.max_rate = rate
+        self.min_rate = max(rate / 16, 0.5)
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ждёт разрешения на одну отправку"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def slow_down(self, retry_after: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._tokens = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"RetryAfter {retry_after} с, скорость рассылки снижена до {self.rate:.1f} сообщ./с")
+
+    def success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class Broadcaster:
+    """Рассылки с сохранением прогресса.
+
+    Получатели идут из базы по возрастанию id страницами (курсор хранится
+    в таблице broadcasts), исход каждой отправки (sent/failed/blocked)
+    записывается в broadcast_deliveries.
+    После перезапуска бота незавершённые рассылки продолжаются с курсора,
+    пропуская тех, кому сообщение уже ушло. Заблокировавшие бота
+    пользователи отмечаются в users.blocked и в рассылки больше не попадают.
+    """
+
+    def __init__(self, users: UserManager, bucket: Optional[TokenBucket] = None):
+        self.users = users
+        self.bucket = bucket or TokenBucket()
+        self._schema_ready = False
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    async def _ensure_schema(self):
+        if self._schema_ready:
+            return
+        await self.users.write("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                text TEXT NOT NULL,
+                cursor INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                done INTEGER DEFAULT 0
+            )
+        """)
+        await self.users.write("""
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                broadcast_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'sent',
+                PRIMARY KEY (broadcast_id, user_id)
+            ) WITHOUT ROWID
+        """)
+        self._schema_ready = True
+
+    async def start(self, bot: Bot, admin_id: int, text: str, status_message_id: Optional[int] = None) -> int:
+        """Создаёт рассылку и запускает её в фоне; возвращает её id"""
+        await self._ensure_schema()
+        row = await self.users.fetchone("SELECT COUNT(*) FROM users WHERE blocked = 0")
+        total = row[0]
+        rows = await self.users.write_returning(
+            "INSERT INTO broadcasts (admin_id, status_message_id, text, total) VALUES (?, ?, ?, ?) "
+            "RETURNING id",
+            (admin_id, status_message_id, text, total)
+        )
+        broadcast_id = rows[0][0]
+        logger.info(f"Рассылка {broadcast_id} от пользователя {admin_id}, получателей: {total}")
+        self._spawn(bot, broadcast_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot):
+        """Продолжает рассылки, прерванные остановкой бота"""
+        await self._ensure_schema()
+        rows = await self.users.fetchall("SELECT id FROM broadcasts WHERE done = 0")
+        for (broadcast_id,) in rows:
+            if broadcast_id not in self._tasks:
+                logger.info(f"Продолжение рассылки {broadcast_id}")
+                self._spawn(bot, broadcast_id)
+
+    async def close(self):
+        """Останавливает рассылки; прогресс уже сохранён и продолжится при запуске"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot: Bot, broadcast_id: int):
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        row = await self.users.fetchone(
+            "SELECT admin_id, status_message_id, text, cursor, total, sent, failed, blocked "
+            "FROM broadcasts WHERE id = ?", (broadcast_id,))
+        admin_id, status_message_id, text, cursor, total, *counters = row
+        stats = {SENT: counters[0], FAILED: counters[1], BLOCKED: counters[2]}
+        # Отправки после последнего сохранённого курсора ещё не попали в счётчики
+        extra = await self.users.fetchall(
+            "SELECT status, COUNT(*) FROM broadcast_deliveries "
+            "WHERE broadcast_id = ? AND user_id > ? GROUP BY status",
+            (broadcast_id, cursor))
+        for status, count in extra:
+            stats[status] += count
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        reported = time.monotonic()
+
+        async def deliver(user_id: int):
+            try:
+                status = await self._send(bot, user_id, text)
+                stats[status] += 1
+                # Каждый исход записывается: после продолжения он попадёт в счётчики
+                # и этому пользователю не будет повторной отправки
+                await self.users.write(
+                    "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+                    (broadcast_id, user_id, status))
+                if status == BLOCKED:
+                    await self.users.set_blocked(user_id)
+            finally:
+                semaphore.release()
+
+        tasks: list[asyncio.Task] = []
+        try:
+            while True:
+                page = await self.users.fetchall(
+                    """SELECT id FROM users
+                       WHERE id > ? AND blocked = 0 AND NOT EXISTS (
+                           SELECT 1 FROM broadcast_deliveries d
+                           WHERE d.broadcast_id = ? AND d.user_id = users.id)
+                       ORDER BY id LIMIT ?""",
+                    (cursor, broadcast_id, BROADCAST_PAGE_SIZE))
+                if not page:
+                    break
+
+                tasks = []
+                for (user_id,) in page:
+                    await semaphore.acquire()
+                    tasks.append(asyncio.create_task(deliver(user_id)))
+                    if time.monotonic() - reported >= PROGRESS_INTERVAL:
+                        reported = time.monotonic()
+                        await self._report(bot, admin_id, status_message_id, stats, total)
+                await asyncio.gather(*tasks)
+
+                cursor = page[-1][0]
+                await self.users.write(
+                    "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?",
+                    (cursor, stats[SENT], stats[FAILED], stats[BLOCKED], broadcast_id))
+
+            await self.users.write("UPDATE broadcasts SET done = 1 WHERE id = ?", (broadcast_id,))
+            await self.users.write("DELETE FROM broadcast_deliveries WHERE broadcast_id = ?", (broadcast_id,))
+        except asyncio.CancelledError:
+            # Отправки текущей страницы не должны пережить остановку рассылки
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"Рассылка {broadcast_id} приостановлена, отправлено {stats[SENT]} из {total}")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в рассылке {broadcast_id}: {e}", exc_info=True)
+            return
+
+        await self._finish(bot, admin_id, status_message_id, stats, total)
+        logger.info(f"Рассылка {broadcast_id} завершена. Успешно отправлено: {stats[SENT]} из {total}")
+
+    async def _send(self, bot: Bot, user_id: int, text: str) -> str:
+        for _ in range(BROADCAST_RETRIES):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(user_id, text)
+                self.bucket.success()
+                return SENT
+            except TelegramRetryAfter as e:
+                self.bucket.slow_down(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось отправить пользователю {user_id}: {e}")
+                return FAILED
+            except Exception as e:
+                logger.warning(f"Не удалось отправить пользователю {user_id}: {e}")
+                return FAILED
+        return FAILED
+
+    @staticmethod
+    async def _report(bot: Bot, admin_id: int, status_message_id: Optional[int], stats: dict, total: int):
+        if status_message_id is None:
+            return
+        try:
+            await bot.edit_message_text(
+                f"🚀 Рассылка в процессе...\n"
+                f"Отправлено: {stats[SENT]} из {total}",
+                chat_id=admin_id, message_id=status_message_id
+            )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки: {e}")
+
+    @staticmethod
+    async def _finish(bot: Bot, admin_id: int, status_message_id: Optional[int], stats: dict, total: int):
+        if status_message_id is not None:
+            try:
+                await bot.delete_message(admin_id, status_message_id)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщение о рассылке: {e}")
+        text = f"✅ Рассылка завершена для {stats[SENT]} из {total} пользователей"
+        if stats[BLOCKED]:
+            text += f"\n🚫 Заблокировали бота: {stats[BLOCKED]}"
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить админу {admin_id} об окончании рассылки: {e}")
+
+
+# Глобальный экземпляр
+broadcaster = Broadcaster(user_manager)
@@ -1,26 +1,171 @@
 import zipfile
 import os
+import io
+import shutil
+import struct
 import logging
 
 logger = logging.getLogger(__name__)
 
-def extract_zip(zip_path):
-    extract_to = "temp"
+MAX_EXPORT_SIZE = int(os.getenv("MAX_EXPORT_SIZE_MB", "512")) * 1024 * 1024
+MAX_COMPRESSION_RATIO = int(os.getenv("MAX_COMPRESSION_RATIO", "100"))
+RATIO_CHECK_MIN = 10 * 1024 * 1024
+
+# Локальный заголовок первого файла ZIP: сигнатура, версия, флаги, метод, время,
+# дата, CRC, сжатый и исходный размер, длины имени и extra
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# Бит 3 флагов: размеры записаны после данных, в заголовке нули
+FLAG_DATA_DESCRIPTOR = 0x08
+# В ZIP64 настоящие размеры лежат в extra-поле, а в заголовке — эта метка
+ZIP64_SIZE = 0xFFFFFFFF
+
+
+class ZipLimitError(Exception):
+    """Архив превышает допустимый размер распаковки или степень сжатия"""
+
+
+class LimitedReader(io.RawIOBase):
+    """Поток распаковки, который обрывается при превышении лимитов"""
+
+    def __init__(self, raw, compress_size: int, max_size: int = MAX_EXPORT_SIZE,
+                 max_ratio: int = MAX_COMPRESSION_RATIO, archive: zipfile.ZipFile | None = None,
+                 file_size: int | None = None):
+        self._raw = raw
+        self._archive = archive
+        self.file_size = file_size
+        self.compress_size = max(compress_size, 1)
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.total = 0
+        self.exceeded = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._raw.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self.total += size
+        self._check()
+        return size
+
+    def _check(self):
+        if self.total > self.max_size:
+            self.exceeded = True
+            raise ZipLimitError(f"Размер распакованных данных превышает {self.max_size} байт")
+        if self.total > RATIO_CHECK_MIN and self.total > self.compress_size * self.max_ratio:
+            self.exceeded = True
+            raise ZipLimitError(f"Степень сжатия архива превышает {self.max_ratio}")
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+            if self._archive is not None:
+                self._archive.close()
+        super().close()
+
+
+def _get_single_member(zip_ref: zipfile.ZipFile):
+    """Возвращает единственный файл архива, проверяя заявленные размеры"""
+    files = zip_ref.infolist()
+
+    if len(files) != 1:
+        logger.error(f"В архиве должен быть только один файл — result.json. Найдено файлов: {len(files)}")
+        return None
+
+    info = files[0]
+    if info.file_size > MAX_EXPORT_SIZE:
+        logger.error(f"Файл в архиве слишком большой: {info.file_size} байт")
+        return None
+    if info.file_size > RATIO_CHECK_MIN and info.file_size > max(info.compress_size, 1) * MAX_COMPRESSION_RATIO:
+        logger.error(f"Подозрительная степень сжатия архива: {info.file_size}/{info.compress_size}")
+        return None
+    return info
+
+
+def check_local_header(head: bytes) -> str | None:
+    """Проверяет начало архива, пока он ещё скачивается.
+
+    Принимает первые байты файла (не меньше LOCAL_HEADER.size) и возвращает
+    причину отказа или None. Полная проверка по центральному каталогу — в open_export.
+    """
+    if len(head) < LOCAL_HEADER.size:
+        return "Файл слишком короткий для ZIP-архива"
+    (signature, _, flags, _, _, _, _, compress_size, file_size,
+     _, _) = LOCAL_HEADER.unpack_from(head)
+    if signature != LOCAL_HEADER_SIGNATURE:
+        return "Файл не является ZIP-архивом"
+    if flags & FLAG_DATA_DESCRIPTOR or ZIP64_SIZE in (compress_size, file_size):
+        # Размеры здесь неизвестны — их проверит open_export по центральному каталогу
+        return None
+    if file_size > MAX_EXPORT_SIZE:
+        return f"Файл в архиве слишком большой: {file_size} байт"
+    if file_size > RATIO_CHECK_MIN and file_size > max(compress_size, 1) * MAX_COMPRESSION_RATIO:
+        return f"Подозрительная степень сжатия архива: {file_size}/{compress_size}"
+    return None
+
+
+def open_export(zip_source):
+    """Открывает файл экспорта прямо из ZIP без распаковки на диск.
+
+    Возвращает бинарный поток с контролем лимитов или None, если архив не подходит.
+    Заявленным в заголовке размерам не доверяем — лимиты проверяются и во время чтения.
+    """
+    try:
+        zip_ref = zipfile.ZipFile(zip_source, 'r')
+    except zipfile.BadZipFile:
+        logger.error("Файл не является ZIP-архивом или поврежден")
+        return None
+
+    try:
+        info = _get_single_member(zip_ref)
+        if info is None:
+            zip_ref.close()
+            return None
+
+        raw = zip_ref.open(info)
+        logger.debug(f"Файл {info.filename} открыт из архива для потокового чтения")
+        return io.BufferedReader(LimitedReader(
+            raw, info.compress_size, archive=zip_ref, file_size=info.file_size
+        ))
+
+    except Exception as e:
+        logger.error(f"Произошла ошибка при открытии архива: {e}", exc_info=True)
+        zip_ref.close()
+        return None
+
+
+def extract_zip(zip_path, extract_to=None):
+    """Распаковывает единственный файл архива в extract_to.
+
+    По умолчанию — в каталог самого архива: архив задачи лежит в её рабочем
+    каталоге (app.workspace), и распакованный файл удаляется вместе с ним.
+    """
+    extract_to = extract_to or os.path.dirname(os.path.abspath(zip_path))
     os.makedirs(extract_to, exist_ok=True)
-    
+
     try:
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            files = zip_ref.namelist()
-            
-            if len(files) != 1:
-                logger.error(f"В архиве должен быть только один файл — result.json. Найдено файлов: {len(files)}")
+            info = _get_single_member(zip_ref)
+            if info is None:
                 return None
 
-            filename = files[0]
-            zip_ref.extractall(extract_to)
+            filename = os.path.basename(info.filename)
+            target = os.path.join(extract_to, filename)
+            with zip_ref.open(info) as raw, open(target, 'wb') as out:
+                try:
+                    shutil.copyfileobj(LimitedReader(raw, info.compress_size), out)
+                except ZipLimitError:
+                    out.close()
+                    os.remove(target)
+                    raise
             logger.debug(f"Архив успешно распакован: {filename}")
-            return os.path.join(extract_to, filename)
+            return target
 
+    except ZipLimitError as e:
+        logger.error(f"Архив отклонён: {e}")
     except zipfile.BadZipFile:
         logger.error(f"Файл не является ZIP-архивом или поврежден: {zip_path}")
     except FileNotFoundError:
@@ -29,5 +174,5 @@ def extract_zip(zip_path):
         logger.error("Архив пустой")
     except Exception as e:
         logger.error(f"Произошла ошибка при распаковке архива {zip_path}: {e}", exc_info=True)
-    
-    return None
\ No newline at end of file
+
+    return None
@@ -0,0 +1,92 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import NamedTuple, Optional
+
+from aiogram import Bot
+
+from app.decoder import LOCAL_HEADER, check_local_header
+
+logger = logging.getLogger(__name__)
+
+# Bot API отдаёт через getFile файлы до 20 MB; свой сервер API может поднять лимит
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "20")) * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+
+
+class DownloadError(Exception):
+    """Файл не подходит для загрузки: слишком большой или не ZIP"""
+
+
+class Download(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+def check_upload_size(file_size: Optional[int]):
+    """Отсекает слишком большие файлы по размеру, который Telegram сообщает заранее"""
+    if file_size is not None and file_size > MAX_UPLOAD_SIZE:
+        raise DownloadError(f"Файл слишком большой (максимум {MAX_UPLOAD_SIZE // 1024 // 1024} MB)")
+
+
+async def download_document(bot: Bot, file_id: str, directory: Optional[str] = None) -> Download:
+    """Скачивает архив на диск по частям, не держа его целиком в памяти.
+
+    Размер проверяется до начала загрузки и по мере поступления данных, начало
+    файла — как только пришёл локальный заголовок ZIP, так что не-архив или
+    «бомба» обрываются на первых килобайтах. SHA-256 считается на лету.
+    Вызывающий удаляет файл Download.path сам.
+    """
+    file = await bot.get_file(file_id)
+    check_upload_size(file.file_size)
+
+    fd, path = tempfile.mkstemp(prefix='upload-', suffix='.zip', dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            async for chunk in _stream(bot, file.file_path):
+                size += len(chunk)
+                # Сервер может прислать больше заявленного — лимит проверяется по факту
+                check_upload_size(size)
+                if len(head) < LOCAL_HEADER.size:
+                    head += chunk[:LOCAL_HEADER.size - len(head)]
+                    if len(head) == LOCAL_HEADER.size:
+                        error = check_local_header(head)
+                        if error is not None:
+                            raise DownloadError(error)
+                digest.update(chunk)
+                out.write(chunk)
+
+        if len(head) < LOCAL_HEADER.size:
+            raise DownloadError(check_local_header(head))
+    except BaseException:
+        os.remove(path)
+        raise
+
+    logger.debug(f"Загружен файл {file_id}: {size} байт, sha256 {digest.hexdigest()}")
+    return Download(path, size, digest.hexdigest())
+
+
+async def _stream(bot: Bot, file_path: str):
+    api = bot.session.api
+    if api.is_local:
+        # Локальный сервер Bot API отдаёт путь к файлу на этой же машине;
+        # чтение в потоке, чтобы файл на медленном диске не останавливал цикл событий
+        with await asyncio.to_thread(open, api.wrap_local_file.to_local(file_path), 'rb') as source:
+            while chunk := await asyncio.to_thread(source.read, DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        return
+
+    async for chunk in bot.session.stream_content(
+        url=api.file_url(bot.token, file_path),
+        timeout=DOWNLOAD_TIMEOUT,
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+        raise_for_status=True,
+    ):
+        yield chunk
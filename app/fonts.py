@@ -0,0 +1,38 @@
+import os
+import threading
+
+from PIL import ImageFont
+
+SYSTEM_FONTS = ("arial.ttf", "/System/Library/Fonts/Arial.ttf")
+
+# Общий на процесс кэш шрифтов по (путь, размер).
+# FreeType вызывается Pillow под GIL, поэтому объекты шрифтов можно делить между потоками.
+_font_cache: dict[tuple[str | None, int], ImageFont.ImageFont] = {}
+_lock = threading.Lock()
+
+
+def _load_font(font_path: str | None, size: int) -> ImageFont.ImageFont:
+    """Загружает шрифт: указанный файл, затем системные, затем встроенный"""
+    candidates = [font_path] if font_path and os.path.exists(font_path) else SYSTEM_FONTS
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        # Pillow >= 10.1: масштабируемый встроенный шрифт
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def get_font(font_path: str | None, size: int) -> ImageFont.ImageFont:
+    """Возвращает шрифт из кэша процесса, загружая его при первом обращении"""
+    key = (font_path, size)
+    font = _font_cache.get(key)
+    if font is None:
+        with _lock:
+            font = _font_cache.get(key)
+            if font is None:
+                font = _font_cache[key] = _load_font(font_path, size)
+    return font
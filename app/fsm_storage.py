@@ -0,0 +1,65 @@
+import json
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from app.user_manager import UserManager
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в базе пользователей.
+
+    Состояние и данные переживают перезапуск и видны всем процессам бота,
+    работающим с одним users.db. Запись идёт через групповой коммит
+    UserManager, чтение — через его пул соединений; кэша нет, иначе
+    процессы видели бы чужие устаревшие состояния.
+    """
+
+    def __init__(self, users: UserManager, key_builder: KeyBuilder | None = None):
+        self.users = users
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._schema_ready = False
+
+    async def _ensure_schema(self):
+        if self._schema_ready:
+            return
+        await self.users.write("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            ) WITHOUT ROWID
+        """)
+        self._schema_ready = True
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._ensure_schema()
+        state = state.state if isinstance(state, State) else state
+        await self.users.write(
+            """INSERT INTO fsm (key, state) VALUES (?, ?)
+               ON CONFLICT(key) DO UPDATE SET state = excluded.state""",
+            (self.key_builder.build(key), state)
+        )
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        await self._ensure_schema()
+        row = await self.users.fetchone("SELECT state FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._ensure_schema()
+        await self.users.write(
+            """INSERT INTO fsm (key, data) VALUES (?, ?)
+               ON CONFLICT(key) DO UPDATE SET data = excluded.data""",
+            (self.key_builder.build(key), json.dumps(dict(data), ensure_ascii=False))
+        )
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        await self._ensure_schema()
+        row = await self.users.fetchone("SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        # Соединениями владеет UserManager, он и закрывает их при остановке бота
+        pass
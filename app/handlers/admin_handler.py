@@ -2,7 +2,7 @@ from aiogram import Dispatcher, types, F
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import asyncio
+from app.broadcast import broadcaster
 from app.user_manager import UserManager
 from app.utils.logger import get_logger
 
@@ -65,58 +65,14 @@ def register_admin_handlers(dp: Dispatcher, user_manager: UserManager):
             return
 
         text_to_send = message.text
-        
-        status_msg = await message.answer("🚀 Запуск рассылки...")
-
-        users = await user_manager.get_users()
-        total_users = len(users)
-        logger.info(f"Начало рассылки от пользователя {user_id}. Получателей: {total_users}")
-        
-        success_count = 0
-        batch_size = 20
-        delay_between_batches = 0.05
-        for i in range(0, total_users, batch_size):
-            batch = users[i:i + batch_size]
-            
-            async def send_to_user(user_id):
-                try:
-                    await message.bot.send_message(user_id, text_to_send)
-                    return (user_id, True, None)
-                except Exception as e:
-                    return (user_id, False, e)
-            
-            tasks = [send_to_user(uid) for uid in batch]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for result in results:
-                if isinstance(result, Exception):
-                    logger.warning(f"Ошибка при отправке: {result}")
-                else:
-                    uid, success, error = result
-                    if success:
-                        success_count += 1
-                    else:
-                        logger.warning(f"Не удалось отправить пользователю {uid}: {error}")
-            
-            if i + batch_size < total_users:
-                await asyncio.sleep(delay_between_batches)
-            
-            if (i + batch_size) % 100 == 0 or i + batch_size >= total_users:
-                try:
-                    await status_msg.edit_text(
-                        f"🚀 Рассылка в процессе...\n"
-                        f"Отправлено: {success_count} из {total_users}"
-                    )
-                except:
-                    pass
-
-        try:
-            await message.bot.delete_message(message.chat.id, status_msg.message_id)
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение о рассылке: {e}")
+        if not text_to_send:
+            await message.answer("❌ Для рассылки нужен текст. Попробуйте ещё раз:")
+            return
 
-        logger.info(f"Рассылка завершена. Успешно отправлено: {success_count} из {total_users}")
-        await message.answer(f"✅ Рассылка завершена для {success_count} из {total_users} пользователей")
+        status_msg = await message.answer("🚀 Запуск рассылки...")
+        # Рассылка идёт в фоне и переживает перезапуск бота; итог придёт отдельным сообщением
+        await broadcaster.start(message.bot, admin_id=user_id, text=text_to_send,
+                                status_message_id=status_msg.message_id)
         await state.clear()
 
     @dp.callback_query(F.data.in_(["add_admin", "del_admin"]))
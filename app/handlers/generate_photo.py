@@ -1,77 +1,133 @@
-from aiogram import Dispatcher, types, F
+from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile, InputMediaDocument
+from aiogram.exceptions import TelegramBadRequest
 import os
 import sys
+import random
 import asyncio
 sys.path.append(os.getcwd())
 import get_photo
-from app.decoder import extract_zip
+from app.decoder import open_export
+from app.pattern_catalog import pattern_catalog
+from app.download import DownloadError, check_upload_size, download_document
+from app.render_pool import render_pool, RenderTimeoutError
+from app.job_queue import Job, job_queue, JobAlreadyRunningError, QueueFullError
 from app.user_manager import UserManager
+from app.workspace import workspaces
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Сначала отправлять маленькое превью, затем заменять его полным рендером
+PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "1") != "0"
+
+# Вместо паттерна: облака во всех формах одним альбомом
+ALL_PATTERNS = '*'
+# sendMediaGroup принимает от 2 до 10 файлов
+MEDIA_GROUP_SIZE = 10
+
+
+def media_chunks(items: list) -> list[list]:
+    """Делит файлы на альбомы по MEDIA_GROUP_SIZE, не оставляя альбома из одного файла"""
+    chunks = [items[start:start + MEDIA_GROUP_SIZE] for start in range(0, len(items), MEDIA_GROUP_SIZE)]
+    if len(chunks) > 1 and len(chunks[-1]) == 1:
+        # 11 файлов — это 9 + 2, а не 10 + 1
+        chunks[-1].insert(0, chunks[-2].pop())
+    return chunks
+
 
 class PhotoGenerationStates(StatesGroup):
     waiting_for_zip = State()
 
 
 def register_photo_handlers(dp: Dispatcher, user_manager: UserManager):
+    # Картинка со всеми формами загружается в Telegram один раз на версию каталога
+    sheet_file_ids: dict[str, str] = {}
+
     @dp.message(F.text == '📷 Сгенерировать фото')
     async def choose_pattern(message: types.Message):
         user_id = message.chat.id
         logger.info(f"Пользователь {user_id} запросил генерацию фото")
         if await user_manager.get_limits(user_id=user_id):
-            patterns_dir = 'patterns'
-            pattern_files = [f for f in os.listdir(patterns_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+            version, patterns = await asyncio.to_thread(pattern_catalog.snapshot)
 
-            if not pattern_files:
+            if not patterns:
                 await message.answer("⚠️ Паттерны не найдены, обратитесь в поддержку.")
                 return
             
             msg_text = "✨ Выберите нужный паттерн\n\n"
-            for idx, pattern in enumerate(pattern_files, start=1):
-                msg_text += f"{idx}: {os.path.splitext(pattern)[0]}\n"
+            for idx, pattern in enumerate(patterns, start=1):
+                msg_text += f"{idx}: {pattern.name}\n"
 
+            # В кнопке — версия каталога: номер из старого списка не укажет на другую форму
             buttons = []
-            for i in range(0, len(pattern_files), 3):
+            for i in range(0, len(patterns), 3):
                 row = [
-                    types.InlineKeyboardButton(text=str(j+1), callback_data=f"pattern_{j}")
-                    for j in range(i, min(i+3, len(pattern_files)))
+                    types.InlineKeyboardButton(text=str(j+1), callback_data=f"pattern_{j}_{version}")
+                    for j in range(i, min(i+3, len(patterns)))
                 ]
                 buttons.append(row)
+            if len(patterns) > 1:
+                buttons.append([types.InlineKeyboardButton(text="🎨 Все формы", callback_data="pattern_all")])
             
             markup = types.InlineKeyboardMarkup(inline_keyboard=buttons)
 
-            await message.answer(msg_text, reply_markup=markup)
+            await send_menu(message, version, msg_text, markup)
         else:
             await message.answer("😢 У вас закончились лимиты, приходите завтра")
 
+    async def send_menu(message: types.Message, version: str, text: str, markup: types.InlineKeyboardMarkup):
+        """Меню выбора с превью всех форм; без превью — просто текстом"""
+        photo = sheet_file_ids.get(version)
+        if photo is None:
+            sheet = await asyncio.to_thread(pattern_catalog.sheet)
+            if sheet is not None:
+                photo = BufferedInputFile(sheet, filename="patterns.png")
+        if photo is not None:
+            try:
+                sent = await message.answer_photo(photo, caption=text, reply_markup=markup)
+                if sent.photo:
+                    sheet_file_ids[version] = sent.photo[-1].file_id
+                return
+            except Exception as e:
+                logger.warning(f"Не удалось отправить превью паттернов: {e}")
+        await message.answer(text, reply_markup=markup)
+
     @dp.callback_query(F.data.startswith('pattern_'))
     async def handle_pattern_choice(callback: types.CallbackQuery, state: FSMContext):
-        index = int(callback.data.split('_')[1])
-        patterns_dir = 'patterns'
-        pattern_files = [f for f in os.listdir(patterns_dir)]
+        _, choice, *version = callback.data.split('_')
         user_id = callback.from_user.id
         
         if await user_manager.get_limits(user_id=user_id):
-            if index >= len(pattern_files):
-                await callback.answer("❌ Ошибка выбора", show_alert=True)
-                return
+            if choice == 'all':
+                selected_pattern = ALL_PATTERNS
+                pattern_name = "Все формы"
+            else:
+                current, patterns = await asyncio.to_thread(pattern_catalog.snapshot)
+                if version != [current]:
+                    await callback.answer("🔄 Список форм обновился, откройте выбор заново", show_alert=True)
+                    return
+                if not (choice.isdigit() and int(choice) < len(patterns)):
+                    await callback.answer("❌ Ошибка выбора", show_alert=True)
+                    return
+                selected_pattern = patterns[int(choice)].file
+                pattern_name = patterns[int(choice)].name
 
-            selected_pattern = pattern_files[index]
-            await callback.answer(f"✅ Вы выбрали: {selected_pattern}")
+            await callback.answer(f"✅ Вы выбрали: {pattern_name}")
 
             await state.update_data(selected_pattern=selected_pattern)
-            await callback.message.edit_text(
+            text = (
                 f"📁 Теперь отправь ZIP-архив с перепиской (только один файл формата json)\n"
                 f"Ссылка как получить историю чата и сделать ZIP архив - [тут](https://t.me/valentine_guide)\n\n"
-                f"Паттерн: *{os.path.splitext(selected_pattern)[0]}*",
-                parse_mode="Markdown"
+                f"Паттерн: *{pattern_name}*"
             )
+            if callback.message.photo:
+                await callback.message.edit_caption(caption=text, parse_mode="Markdown")
+            else:
+                await callback.message.edit_text(text, parse_mode="Markdown")
             await state.set_state(PhotoGenerationStates.waiting_for_zip)
         else:
             await callback.answer("😢 У вас закончились лимиты, приходите завтра", show_alert=True)
@@ -80,7 +136,8 @@ def register_photo_handlers(dp: Dispatcher, user_manager: UserManager):
     async def handle_zip_upload(message: types.Message, state: FSMContext):
         user_id = message.from_user.id
         
-        if not await user_manager.get_limits(user_id=user_id):
+        # Допуск задачи — по базе: лимит мог израсходовать задачу другой процесс бота
+        if not await user_manager.get_limits(user_id=user_id, fresh=True):
             await message.answer("😢 У вас закончились лимиты, приходите завтра")
             await state.clear()
             return
@@ -93,6 +150,13 @@ def register_photo_handlers(dp: Dispatcher, user_manager: UserManager):
             await message.answer("⚠️ Нужен файл в формате .zip. Попробуй еще раз:")
             return
 
+        try:
+            # Размер известен из сообщения — слишком большой архив не займёт место в очереди
+            check_upload_size(message.document.file_size)
+        except DownloadError as e:
+            await message.answer(f"❌ {e}")
+            return
+
         data = await state.get_data()
         selected_pattern = data.get("selected_pattern")
         
@@ -102,72 +166,241 @@ def register_photo_handlers(dp: Dispatcher, user_manager: UserManager):
             return
 
         try:
-            file = await message.bot.get_file(message.document.file_id)
-            downloaded_file = await message.bot.download_file(file.file_path)
-
-            temp_dir = 'temp'
-            os.makedirs(temp_dir, exist_ok=True)
-            zip_path = os.path.join(temp_dir, f"{user_id}.zip")
-
-            file_data = downloaded_file.read()
-            def save_file(path, data):
-                with open(path, 'wb') as f:
-                    f.write(data)
-            await asyncio.to_thread(save_file, zip_path, file_data)
-
-            json_path = await asyncio.to_thread(extract_zip, zip_path)
-            if not json_path or not os.path.exists(json_path):
-                await message.answer("❌ В архиве должен быть только один файл — result.json.")
-                if os.path.exists(zip_path):
-                    await asyncio.to_thread(os.remove, zip_path)
-                await state.clear()
-                return
-            
-            status_msg = await message.answer("🧬 Генерация фото...")
-            logger.info(f"Начало генерации фото для пользователя {user_id}, паттерн: {selected_pattern}")
-            
-            if os.path.exists(zip_path):
-                await asyncio.to_thread(os.remove, zip_path)
+            await job_queue.check(user_id)
+        except JobAlreadyRunningError:
+            await message.answer("⏳ Предыдущее фото ещё генерируется, дождитесь результата")
+            return
+        except QueueFullError:
+            logger.warning(f"Очередь генераций заполнена, запрос пользователя {user_id} отклонён")
+            await message.answer("🚦 Сервер сейчас перегружен, попробуйте через несколько минут")
+            await state.clear()
+            return
 
-            photo_path = None
+        # Задача попадает в общую таблицу: её заберёт любой процесс бота, и она
+        # переживёт перезапуск. Сообщение о статусе удалит тот, кто её выполнит
+        status_msg = await message.answer("🧬 Генерация фото...")
+        try:
+            await job_queue.submit(user_id, message.document.file_id, selected_pattern,
+                                   status_message_id=status_msg.message_id)
+        except (QueueFullError, JobAlreadyRunningError):
+            await message.bot.delete_message(user_id, status_msg.message_id)
+            await message.answer("🚦 Сервер сейчас перегружен, попробуйте через несколько минут")
+        except Exception as e:
+            logger.error(f"Ошибка при обработке файла для пользователя {user_id}: {e}", exc_info=True)
+            await message.answer(f"❌ Произошла ошибка при обработке файла: {e}")
+        finally:
+            await state.clear()
+
+    async def run_job(bot: Bot, job: Job):
+        """Выполняет задачу из очереди и убирает сообщение о статусе"""
+        if job.position and job.status_message_id:
             try:
-                photo_path, first_msg = await asyncio.to_thread(
-                    get_photo.main,
-                    user_id=user_id,
-                    pattern=os.path.splitext(selected_pattern)[0],
-                    file=json_path
-                )
+                await bot.edit_message_text("🧬 Генерация фото...", chat_id=job.user_id,
+                                            message_id=job.status_message_id)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить статус для пользователя {job.user_id}: {e}")
+
+        try:
+            # Свой каталог на задачу: файлы одновременных задач не пересекаются
+            async with workspaces.job(job.id) as workdir:
+                await process_zip(bot, job.user_id, job.file_id, job.pattern, workdir)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке файла для пользователя {job.user_id}: {e}", exc_info=True)
+            await bot.send_message(job.user_id, f"❌ Произошла ошибка при обработке файла: {e}")
+        # При остановке процесса (CancelledError) статус остаётся: задача вернётся в очередь
+        await delete_status(bot, job)
+
+    async def show_position(bot: Bot, job: Job, position: int):
+        if job.status_message_id:
+            await bot.edit_message_text(f"🕐 Вы в очереди: {position}\nГенерация начнётся автоматически",
+                                        chat_id=job.user_id, message_id=job.status_message_id)
+
+    async def give_up(bot: Bot, job: Job):
+        await delete_status(bot, job)
+        await bot.send_message(job.user_id, "❌ Не удалось сгенерировать фото, попробуйте другой архив")
+
+    async def delete_status(bot: Bot, job: Job):
+        if not job.status_message_id:
+            return
+        try:
+            await bot.delete_message(job.user_id, job.status_message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить сообщение о генерации для пользователя {job.user_id}: {e}")
 
-                if photo_path and os.path.exists(photo_path):
-                    document = FSInputFile(photo_path)
-                    await message.bot.send_document(
-                        chat_id=user_id,
-                        document=document,
-                        caption=f"🎉 Облако слов сгенерировано успешно!\n\n✨ Первое сообщение:\n'{first_msg}'"
-                    )
-                    await user_manager.increment_limits(user_id=user_id)
-                    logger.info(f"Фото успешно сгенерировано и отправлено пользователю {user_id}")
+    job_queue.register(run_job, on_position=show_position, on_failure=give_up)
+
+    async def process_zip(bot: Bot, user_id: int, file_id: str, selected_pattern: str, workdir: str):
+        """Скачивает архив в рабочий каталог задачи, считает слова и отправляет готовое облако"""
+        try:
+            download = await download_document(bot, file_id, directory=workdir)
+        except DownloadError as e:
+            logger.warning(f"Архив пользователя {user_id} отклонён при загрузке: {e}")
+            await bot.send_message(user_id, f"❌ {e}")
+            return
+
+        logger.info(f"Архив пользователя {user_id} загружен: {download.size} байт, sha256 {download.sha256[:16]}")
+        await render_archive(bot, user_id, download.path, selected_pattern)
+
+    async def render_archive(bot: Bot, user_id: int, archive_path: str, selected_pattern: str):
+        """Проверяет архив по центральному каталогу, считает слова и отправляет облако"""
+        export = await asyncio.to_thread(open_export, archive_path)
+        if export is None:
+            await bot.send_message(user_id, "❌ В архиве должен быть только один файл — result.json.")
+            return
+
+        logger.info(f"Начало генерации фото для пользователя {user_id}, паттерн: {selected_pattern}")
+
+        try:
+            words, first_msg = await asyncio.to_thread(get_photo.get_words_from_messages, export)
+            delivered = False
+            if words is not None:
+                caption = f"🎉 Облако слов сгенерировано успешно!\n\n✨ Первое сообщение:\n'{first_msg}'"
+                if selected_pattern == ALL_PATTERNS:
+                    delivered = await send_all_patterns(bot, user_id, words, caption)
                 else:
-                    await message.answer("❌ Ошибка: не удалось создать фото")
+                    delivered = await send_pattern(bot, user_id, words, selected_pattern, caption)
 
-            except Exception as e:
-                logger.error(f"Ошибка при генерации фото для пользователя {user_id}: {e}", exc_info=True)
-                await message.answer(f"❌ Ошибка при генерации: {e}")
+            if delivered:
+                await user_manager.increment_limits(user_id=user_id)
+                logger.info(f"Фото успешно сгенерировано и отправлено пользователю {user_id}")
+            elif export.raw.exceeded:
+                logger.warning(f"Архив пользователя {user_id} превышает лимиты распаковки")
+                await bot.send_message(user_id, "❌ Архив слишком большой или повреждён")
+            else:
+                await bot.send_message(user_id, "❌ Ошибка: не удалось создать фото")
+
+        except RenderTimeoutError as e:
+            logger.warning(f"Генерация для пользователя {user_id} прервана по таймауту: {e}")
+            await bot.send_message(user_id, "⏳ Генерация заняла слишком много времени, попробуйте позже")
+
+        except Exception as e:
+            logger.error(f"Ошибка при генерации фото для пользователя {user_id}: {e}", exc_info=True)
+            await bot.send_message(user_id, f"❌ Ошибка при генерации: {e}")
+
+        finally:
+            export.close()
 
-            finally:
+    async def send_pattern(bot: Bot, user_id: int, words: list[str],
+                           selected_pattern: str, caption: str) -> bool:
+        """Рисует облако в одной форме (с превью) и отправляет его"""
+        pattern = os.path.splitext(selected_pattern)[0]
+        # Общий seed — превью и полный рендер в одной цветовой схеме
+        seed = random.getrandbits(32)
+        preview_task = None
+        preview_msg = None
+        if PREVIEW_ENABLED:
+            # Превью ставится в пул первым, чтобы не ждать полный рендер
+            preview_task = asyncio.create_task(render_pool.submit(
+                get_photo.render_pattern, words=words, pattern=selected_pattern, preview=True, seed=seed))
+        render_task = asyncio.create_task(render_pool.submit(
+            get_photo.render_pattern, words=words, pattern=selected_pattern, seed=seed))
+        try:
+            if preview_task is not None:
+                preview_msg = await send_preview(bot, user_id, pattern, preview_task, render_task)
+            photo = await render_task
+            if not photo:
+                return False
+
+            document = BufferedInputFile(photo, filename=f"{pattern}_user_id-{user_id}.png")
+            await deliver(bot, user_id, preview_msg, document, caption)
+            preview_msg = None
+            return True
+
+        finally:
+            if not render_task.done():
+                render_task.cancel()
+            if preview_msg is not None:
+                # Полного рендера не будет — превью без него только путает
                 try:
-                    await message.bot.delete_message(user_id, status_msg.message_id)
+                    await bot.delete_message(user_id, preview_msg.message_id)
                 except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение о генерации для пользователя {user_id}: {e}")
+                    logger.warning(f"Не удалось удалить превью для пользователя {user_id}: {e}")
 
-                if os.path.exists(json_path):
-                    await asyncio.to_thread(os.remove, json_path)
-                if photo_path and os.path.exists(photo_path):
-                    await asyncio.to_thread(os.remove, photo_path)
-            
-            await state.clear()
-            
+    async def send_all_patterns(bot: Bot, user_id: int, words: list[str], caption: str) -> bool:
+        """Рисует облако во всех формах параллельно и отправляет одним альбомом"""
+        patterns = await asyncio.to_thread(pattern_catalog.patterns)
+        seed = random.getrandbits(32)
+        # Задачи расходятся по свободным воркерам пула, каждый на своём ядре
+        results = await asyncio.gather(
+            *(render_pool.submit(get_photo.render_pattern, words=words, pattern=pattern.file, seed=seed)
+              for pattern in patterns),
+            return_exceptions=True
+        )
+
+        rendered = []
+        for pattern, result in zip(patterns, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Форма {pattern.file} для пользователя {user_id} не сгенерирована: {result}")
+            elif result:
+                rendered.append((pattern.name, result))
+        if not rendered:
+            # Все формы упали — сообщаем пользователю причину первой ошибки
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            return False
+
+        if len(rendered) == 1:
+            # Альбом из одного файла Telegram не примет
+            pattern, photo = rendered[0]
+            await bot.send_document(
+                chat_id=user_id,
+                document=BufferedInputFile(photo, filename=f"{pattern}_user_id-{user_id}.png"),
+                caption=caption
+            )
+            return True
+
+        # В альбоме от 2 до MEDIA_GROUP_SIZE файлов, подпись — у последнего
+        chunks = media_chunks(rendered)
+        for number, chunk in enumerate(chunks, start=1):
+            last = number == len(chunks)
+            media = [
+                InputMediaDocument(
+                    media=BufferedInputFile(photo, filename=f"{pattern}_user_id-{user_id}.png"),
+                    caption=caption if last and idx == len(chunk) - 1 else None
+                )
+                for idx, (pattern, photo) in enumerate(chunk)
+            ]
+            await bot.send_media_group(chat_id=user_id, media=media)
+        return True
+
+    async def send_preview(bot: Bot, user_id: int, pattern: str,
+                           preview_task: asyncio.Task, render_task: asyncio.Task) -> types.Message | None:
+        """Отправляет превью, если оно готово раньше полного рендера"""
+        try:
+            await asyncio.wait({preview_task, render_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not preview_task.done():
+                # Отмена убила бы воркер пула — просто не ждём превью
+                preview_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+                return None
+            preview = preview_task.result()
+            if not preview or render_task.done():
+                return None
+            return await bot.send_photo(
+                chat_id=user_id,
+                photo=BufferedInputFile(preview, filename=f"{pattern}_preview.png"),
+                caption="👀 Превью, полное изображение почти готово..."
+            )
         except Exception as e:
-            logger.error(f"Ошибка при обработке файла для пользователя {user_id}: {e}", exc_info=True)
-            await message.answer(f"❌ Произошла ошибка при обработке файла: {e}")
-            await state.clear()
\ No newline at end of file
+            logger.warning(f"Не удалось отправить превью пользователю {user_id}: {e}")
+            return None
+
+    async def deliver(bot: Bot, user_id: int, preview_msg: types.Message | None,
+                      document: BufferedInputFile, caption: str):
+        """Заменяет превью полным рендером или отправляет его отдельным сообщением"""
+        if preview_msg is not None:
+            try:
+                await bot.edit_message_media(
+                    chat_id=user_id,
+                    message_id=preview_msg.message_id,
+                    media=InputMediaDocument(media=document, caption=caption)
+                )
+                return
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось заменить превью у пользователя {user_id}: {e}")
+                try:
+                    await bot.delete_message(user_id, preview_msg.message_id)
+                except Exception:
+                    pass
+
+        await bot.send_document(chat_id=user_id, document=document, caption=caption)
@@ -0,0 +1,281 @@
+import os
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from aiogram import Bot
+
+from app.user_manager import UserManager, user_manager
+
+logger = logging.getLogger(__name__)
+
+# Задач одновременно в этом процессе; общая пропускная способность растёт с числом процессов
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", "0")) or os.cpu_count() or 1
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "20"))
+# Задача процесса, который упал, не отпустив её, снова становится доступной через JOB_LEASE секунд.
+# Пока задача выполняется, аренда продлевается каждые JOB_LEASE_RENEW секунд
+JOB_LEASE = float(os.getenv("JOB_LEASE", "900"))
+JOB_LEASE_RENEW = JOB_LEASE / 3
+JOB_MAX_ATTEMPTS = 2
+# Как часто простаивающий процесс заглядывает в таблицу за задачами других процессов
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+
+class QueueFullError(Exception):
+    """Очередь генераций заполнена"""
+
+
+class JobAlreadyRunningError(Exception):
+    """У пользователя уже есть задача в очереди или в работе"""
+
+
+class Job(NamedTuple):
+    id: int
+    user_id: int
+    file_id: str
+    pattern: str
+    status_message_id: Optional[int]
+    # Место в очереди, которое пользователь видел последним (0 — не ждал)
+    position: int
+    attempts: int
+
+
+JobHandler = Callable[[Bot, Job], Awaitable[None]]
+PositionCallback = Callable[[Bot, Job, int], Awaitable[None]]
+FailureCallback = Callable[[Bot, Job], Awaitable[None]]
+
+_JOB_COLUMNS = "id, user_id, file_id, pattern, status_message_id, position, attempts"
+# Задачи, которые можно забрать: ждущие и брошенные упавшим процессом (параметр — текущее время)
+_CLAIMABLE = "status = 'queued' OR (status = 'running' AND lease_until < ?)"
+
+
+class JobQueue:
+    """Очередь генераций в SQLite, общая для всех процессов бота на хосте.
+
+    Задача записывается в таблицу jobs при загрузке архива и переживает
+    перезапуск. Каждый процесс выполняет до max_concurrent задач, забирая
+    их атомарным UPDATE ... RETURNING — одну задачу получает ровно один
+    процесс. Забранная задача арендуется на JOB_LEASE секунд: если процесс
+    умер, её заберёт другой. При штатной остановке незавершённые задачи
+    сразу возвращаются в очередь. У пользователя может быть только одна задача.
+    """
+
+    def __init__(self, users: UserManager, max_concurrent: int = JOB_MAX_CONCURRENT,
+                 max_queue: int = JOB_MAX_QUEUE):
+        self.users = users
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handler: Optional[JobHandler] = None
+        self._on_position: Optional[PositionCallback] = None
+        self._on_failure: Optional[FailureCallback] = None
+        self._schema_ready = False
+        self._running: set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def register(self, handler: JobHandler, on_position: Optional[PositionCallback] = None,
+                 on_failure: Optional[FailureCallback] = None):
+        """Задаёт обработчик задач и уведомления о месте в очереди и об отказе"""
+        self._handler = handler
+        self._on_position = on_position
+        self._on_failure = on_failure
+
+    async def _ensure_schema(self):
+        if self._schema_ready:
+            return
+        await self.users.write("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL UNIQUE,
+                file_id TEXT NOT NULL,
+                pattern TEXT NOT NULL,
+                status_message_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'queued',
+                position INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                worker TEXT,
+                lease_until REAL DEFAULT 0
+            )
+        """)
+        await self.users.write("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+        self._schema_ready = True
+
+    async def check(self, user_id: int):
+        """Проверяет, примет ли очередь задачу, не занимая места"""
+        await self._ensure_schema()
+        if await self.users.fetchone("SELECT 1 FROM jobs WHERE user_id = ?", (user_id,)):
+            raise JobAlreadyRunningError(f"У пользователя {user_id} уже есть задача")
+        row = await self.users.fetchone("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
+        if row[0] >= self.max_queue:
+            raise QueueFullError("Очередь генераций заполнена")
+
+    async def submit(self, user_id: int, file_id: str, pattern: str,
+                     status_message_id: Optional[int] = None) -> int:
+        """Ставит задачу в очередь и возвращает её id"""
+        await self.check(user_id)
+        try:
+            rows = await self.users.write_returning(
+                "INSERT INTO jobs (user_id, file_id, pattern, status_message_id) VALUES (?, ?, ?, ?) "
+                "RETURNING id",
+                (user_id, file_id, pattern, status_message_id)
+            )
+        except sqlite3.IntegrityError:
+            # Другой процесс успел поставить задачу этого пользователя
+            raise JobAlreadyRunningError(f"У пользователя {user_id} уже есть задача") from None
+        logger.info(f"Задача {rows[0][0]} пользователя {user_id} поставлена в очередь")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return rows[0][0]
+
+    async def start(self, bot: Bot):
+        """Запускает выборку задач из таблицы в этом процессе"""
+        if self._loop_task is not None:
+            return
+        await self._ensure_schema()
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._claim_loop(bot))
+        logger.info(f"Очередь генераций запущена ({self.worker_id}, до {self.max_concurrent} задач)")
+
+    async def close(self):
+        """Останавливает выборку; прерванные задачи возвращаются в очередь"""
+        if self._loop_task is None:
+            return
+        self._loop_task.cancel()
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(self._loop_task, *tasks, return_exceptions=True)
+        self._loop_task = None
+        await self.users.write(
+            "UPDATE jobs SET status = 'queued', worker = NULL, attempts = attempts - 1 "
+            "WHERE status = 'running' AND worker = ?",
+            (self.worker_id,)
+        )
+
+    async def _claim_loop(self, bot: Bot):
+        while True:
+            # Сброс до проверки: сигнал, пришедший позже, не потеряется
+            self._wakeup.clear()
+            free = len(self._running) < self.max_concurrent
+            if free:
+                try:
+                    job = await self._claim()
+                except Exception as e:
+                    logger.error(f"Не удалось забрать задачу из очереди: {e}", exc_info=True)
+                    job = None
+                if job is not None:
+                    task = asyncio.create_task(self._run(bot, job))
+                    self._running.add(task)
+                    task.add_done_callback(self._finished)
+                    continue
+
+            await self._notify_positions(bot)
+            # Свободный процесс опрашивает таблицу (задачи могли поставить другие процессы),
+            # занятый ждёт, пока освободится слот или сюда же придёт новая задача
+            await self._wait(JOB_POLL_INTERVAL if free else None)
+
+    async def _wait(self, timeout: Optional[float]):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _finished(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._wakeup.set()
+
+    async def _claim(self) -> Optional[Job]:
+        now = time.time()
+        # Опрос идёт через читателей: пустая очередь не занимает писателя и не пишет в WAL
+        if not await self.users.fetchone(f"SELECT 1 FROM jobs WHERE {_CLAIMABLE} LIMIT 1", (now,)):
+            return None
+        rows = await self.users.write_returning(
+            f"""UPDATE jobs
+                SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = (SELECT id FROM jobs WHERE {_CLAIMABLE} ORDER BY id LIMIT 1)
+                RETURNING {_JOB_COLUMNS}""",
+            (self.worker_id, now + JOB_LEASE, now)
+        )
+        return Job(*rows[0]) if rows else None
+
+    async def _run(self, bot: Bot, job: Job):
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        cancelled = False
+        try:
+            if job.attempts > JOB_MAX_ATTEMPTS:
+                # Задача уже роняла процессы — не пробуем бесконечно
+                logger.error(f"Задача {job.id} пользователя {job.user_id} снята после {job.attempts - 1} попыток")
+                if self._on_failure is not None:
+                    await self._on_failure(bot, job)
+            else:
+                await self._handler(bot, job)
+        except asyncio.CancelledError:
+            # Остановка процесса: строку не трогаем, close() вернёт задачу в очередь
+            cancelled = True
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в задаче {job.id} пользователя {job.user_id}: {e}", exc_info=True)
+        finally:
+            heartbeat.cancel()
+            if not cancelled:
+                await self._release(job)
+
+    async def _keep_lease(self, job: Job):
+        """Продлевает аренду, пока задача выполняется в этом процессе"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_RENEW)
+            try:
+                renewed = await self.users.write(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                    (time.time() + JOB_LEASE, job.id, self.worker_id)
+                )
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задачи {job.id}: {e}", exc_info=True)
+                continue
+            if not renewed:
+                logger.warning(f"Задача {job.id} пользователя {job.user_id} больше не принадлежит {self.worker_id}")
+                return
+
+    async def _release(self, job: Job):
+        """Удаляет выполненную задачу, если её не успел забрать другой процесс"""
+        try:
+            await self.users.write("DELETE FROM jobs WHERE id = ? AND worker = ?", (job.id, self.worker_id))
+        except Exception as e:
+            logger.error(f"Не удалось удалить выполненную задачу {job.id}: {e}", exc_info=True)
+
+    async def _notify_positions(self, bot: Bot):
+        """Сообщает ожидающим их новое место, если оно изменилось"""
+        if self._on_position is None:
+            return
+        try:
+            rows = await self.users.fetchall(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE status = 'queued' ORDER BY id")
+        except Exception as e:
+            logger.error(f"Не удалось прочитать очередь генераций: {e}", exc_info=True)
+            return
+        for position, row in enumerate(rows, start=1):
+            job = Job(*row)
+            if job.position == position:
+                continue
+            # Позицию меняет только тот процесс, чьё обновление прошло: сообщение правится один раз
+            try:
+                changed = await self.users.write(
+                    "UPDATE jobs SET position = ? WHERE id = ? AND status = 'queued' AND position = ?",
+                    (position, job.id, job.position)
+                )
+                if changed:
+                    await self._on_position(bot, job, position)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить позицию в очереди для пользователя {job.user_id}: {e}")
+
+
+# Глобальный экземпляр
+job_queue = JobQueue(user_manager)
@@ -0,0 +1,305 @@
+import random
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+from app.fonts import get_font
+
+HORIZONTAL = None
+VERTICAL = Image.Transpose.ROTATE_90
+MEASURE_CACHE_SIZE = 4096
+
+ColorFunc = Callable[..., str]
+
+
+class PlacedWord(NamedTuple):
+    """Слово в готовой раскладке; position — левый верхний угол (x, y) на холсте раскладки"""
+    word: str
+    font_size: int
+    position: tuple[int, int]
+    orientation: Image.Transpose | None
+    color: str
+
+
+@lru_cache(maxsize=MEASURE_CACHE_SIZE * 4)
+def text_box(font_path: str | None, word: str, size: int,
+             orientation: Image.Transpose | None, margin: int) -> tuple[int, int]:
+    """Размер (h, w) слова с отступом margin, без растеризации"""
+    left, top, right, bottom = get_font(font_path, size).getbbox(word)
+    h, w = max(1, bottom - top) + 2 * margin, max(1, right - left) + 2 * margin
+    return (h, w) if orientation is None else (w, h)
+
+
+@lru_cache(maxsize=MEASURE_CACHE_SIZE)
+def render_text(font_path: str | None, word: str, size: int,
+                orientation: Image.Transpose | None) -> Image.Image:
+    """Растеризует слово в маску L, обрезанную по границам глифов (результат кэшируется)"""
+    font = get_font(font_path, size)
+    left, top, right, bottom = font.getbbox(word)
+    tile = Image.new('L', (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(tile).text((-left, -top), word, fill=255, font=font)
+    if orientation is not None:
+        tile = tile.transpose(orientation)
+    return tile
+
+
+@lru_cache(maxsize=MEASURE_CACHE_SIZE)
+def measure(font_path: str | None, word: str, size: int,
+            orientation: Image.Transpose | None, margin: int) -> np.ndarray:
+    """Пиксели, которые займёт слово, с отступом margin со всех сторон (только для чтения)"""
+    glyph = np.asarray(render_text(font_path, word, size, orientation)) > 0
+    if margin:
+        glyph = _dilate(np.pad(glyph, margin), margin)
+    glyph.setflags(write=False)
+    return glyph
+
+
+def _dilate(glyph: np.ndarray, radius: int) -> np.ndarray:
+    """Расширяет занятые пиксели на radius квадратным окном (по строкам, затем по столбцам)"""
+    rows = glyph.copy()
+    for shift in range(1, radius + 1):
+        rows[shift:] |= glyph[:-shift]
+        rows[:-shift] |= glyph[shift:]
+    result = rows.copy()
+    for shift in range(1, radius + 1):
+        result[:, shift:] |= rows[:, :-shift]
+        result[:, :-shift] |= rows[:, shift:]
+    return result
+
+
+class _Grid:
+    """Булева карта занятости с таблицей сумм (summed-area table)"""
+
+    def __init__(self, occupied: np.ndarray):
+        self.occupied = occupied
+        self.sat = np.zeros((occupied.shape[0] + 1, occupied.shape[1] + 1), dtype=np.int32)
+        np.cumsum(occupied, axis=0, dtype=np.int32, out=self.sat[1:, 1:])
+        np.cumsum(self.sat[1:, 1:], axis=1, out=self.sat[1:, 1:])
+        # Занятость только растёт: не поместившийся прямоугольник
+        # (и любой не меньший) больше не ищется
+        self._failed: list[tuple[int, int]] = []
+
+    def sample(self, h: int, w: int, rng: np.random.Generator) -> tuple[int, int] | None:
+        """Случайная позиция (y, x) свободного прямоугольника h × w или None"""
+        if h > self.occupied.shape[0] or w > self.occupied.shape[1]:
+            return None
+        if any(h >= failed_h and w >= failed_w for failed_h, failed_w in self._failed):
+            return None
+
+        sat = self.sat
+        counts = sat[h:, w:] - sat[:-h, w:] - sat[h:, :-w] + sat[:-h, :-w]
+        free = np.flatnonzero(counts == 0)
+        if not free.size:
+            self._failed = [(failed_h, failed_w) for failed_h, failed_w in self._failed
+                            if failed_h < h or failed_w < w]
+            self._failed.append((h, w))
+            return None
+        return divmod(int(free[rng.integers(free.size)]), counts.shape[1])
+
+    def mark(self, y: int, x: int, cells: np.ndarray):
+        """Отмечает ячейки занятыми и обновляет таблицу сумм ниже и правее них"""
+        h, w = cells.shape
+        region = self.occupied[y:y + h, x:x + w]
+        added = cells & ~region
+        region |= cells
+
+        delta = np.cumsum(added, axis=0, dtype=np.int32).cumsum(axis=1)
+        sat = self.sat
+        sat[y + 1:y + h + 1, x + 1:x + w + 1] += delta
+        sat[y + h + 1:, x + 1:x + w + 1] += delta[-1]
+        sat[y + 1:y + h + 1, x + w + 1:] += delta[:, -1:]
+        sat[y + h + 1:, x + w + 1:] += delta[-1, -1]
+
+
+class Occupancy:
+    """Занятость холста на нескольких уровнях: ячейки CELL_SIZES и отдельные пиксели.
+
+    Все позиции прямоугольника проверяются сразу несколькими векторными
+    операциями над таблицей сумм. Поиск идёт от грубых сеток к точной
+    (ячейка занята, если занят хоть один её пиксель): грубая сетка в cell²
+    раз меньше, и пока на холсте есть место, её хватает. Точная сетка
+    нужна, когда остаются только узкие промежутки.
+    """
+
+    CELL_SIZES = (8, 2)
+
+    def __init__(self, mask: np.ndarray):
+        self.height, self.width = mask.shape
+        step = max(self.CELL_SIZES)
+        padded_h, padded_w = -(-self.height // step) * step, -(-self.width // step) * step
+        # Поля до кратного ячейке размера считаются занятыми
+        occupied = np.ones((padded_h, padded_w), dtype=bool)
+        occupied[:self.height, :self.width] = np.asarray(mask) == 255
+
+        self.fine = _Grid(occupied)
+        self.levels = [(cell, _Grid(self._cells(occupied, cell))) for cell in self.CELL_SIZES]
+
+    @staticmethod
+    def _cells(occupied: np.ndarray, cell: int) -> np.ndarray:
+        h, w = occupied.shape
+        return occupied.reshape(h // cell, cell, w // cell, cell).any(axis=(1, 3))
+
+    def sample_position(self, h: int, w: int, rng: np.random.Generator) -> tuple[int, int] | None:
+        """Случайная позиция (y, x), где свободен прямоугольник h × w, или None"""
+        for cell, grid in self.levels:
+            position = grid.sample(-(-h // cell), -(-w // cell), rng)
+            if position is not None:
+                return position[0] * cell, position[1] * cell
+        return self.fine.sample(h, w, rng)
+
+    def place(self, y: int, x: int, glyph: np.ndarray):
+        """Отмечает пиксели глифа занятыми на всех сетках"""
+        self.fine.mark(y, x, glyph)
+
+        h, w = glyph.shape
+        for cell, grid in self.levels:
+            top, left = y // cell, x // cell
+            bottom, right = -(-(y + h) // cell), -(-(x + w) // cell)
+            block = self.fine.occupied[top * cell:bottom * cell, left * cell:right * cell]
+            grid.mark(top, left, self._cells(block, cell))
+
+
+class Layout:
+    """Готовая раскладка: список слов и отрисовка в изображение"""
+
+    def __init__(self, words: list[PlacedWord], size: tuple[int, int], font_path: str | None,
+                 scale: float = 1, mode: str = 'RGBA', background_color: str | None = None):
+        self.words = words
+        self.size = size
+        self.font_path = font_path
+        self.scale = scale
+        self.mode = mode
+        self.background_color = background_color
+
+    def to_image(self) -> Image.Image:
+        """Рисует раскладку в масштабе scale"""
+        width, height = self.size
+        image = Image.new('RGBA', (int(width * self.scale), int(height * self.scale)),
+                          self.background_color or (0, 0, 0, 0))
+        for placed in self.words:
+            size = max(1, round(placed.font_size * self.scale))
+            tile = render_text(self.font_path, placed.word, size, placed.orientation)
+            layer = Image.new('RGBA', tile.size, ImageColor.getcolor(placed.color, 'RGBA'))
+            layer.putalpha(tile)
+            x, y = placed.position
+            image.alpha_composite(layer, (round(x * self.scale), round(y * self.scale)))
+        return image if self.mode == 'RGBA' else image.convert(self.mode)
+
+
+class LayoutEngine:
+    """Раскладка слов по маске на NumPy.
+
+    Повторяет порядок WordCloud (слова по убыванию частоты, relative_scaling,
+    поворот на 90° с вероятностью 1 - prefer_horizontal), но подбирает
+    размер шрифта двоичным поиском и не останавливается на первом слове,
+    которому не хватило места: проход по словам повторяется, пока хоть
+    одно из них помещается и не набрано max_words.
+    """
+
+    def __init__(self, font_path: str | None = None, min_font_size: int = 4, max_font_size: int = 100,
+                 font_step: int = 1, margin: int = 1, prefer_horizontal: float = 0.9,
+                 relative_scaling: float = 0.5, max_words: int = 1000, repeat: bool = True,
+                 scale: float = 1, background_color: str | None = None,
+                 random_state: int | None = None):
+        self.font_path = font_path
+        self.min_font_size = min_font_size
+        self.max_font_size = max_font_size
+        self.font_step = font_step
+        self.margin = margin
+        self.prefer_horizontal = prefer_horizontal
+        self.relative_scaling = relative_scaling
+        self.max_words = max_words
+        self.repeat = repeat
+        self.scale = scale
+        self.background_color = background_color
+        self.random_state = random_state
+
+    def _find_size(self, occupancy: Occupancy, word: str, font_size: int,
+                   orientation: Image.Transpose | None, rng: np.random.Generator):
+        """Наибольший размер шрифта не больше font_size, для которого нашлось место"""
+        sizes = range(font_size, self.min_font_size - 1, -self.font_step)
+        if not sizes:
+            return None
+
+        def attempt(index: int):
+            box = text_box(self.font_path, word, sizes[index], orientation, self.margin)
+            position = occupancy.sample_position(*box, rng)
+            return None if position is None else (sizes[index], position)
+
+        found = attempt(0)
+        if found is not None or len(sizes) == 1:
+            return found
+        found = attempt(len(sizes) - 1)
+        if found is None:
+            return None
+
+        # Размеры между fits_low (не помещается) и fits_high (помещается)
+        fits_low, fits_high = 0, len(sizes) - 1
+        while fits_high - fits_low > 1:
+            middle = (fits_low + fits_high) // 2
+            result = attempt(middle)
+            if result is None:
+                fits_low = middle
+            else:
+                fits_high, found = middle, result
+        return found
+
+    def layout(self, frequencies: dict[str, float], mask: np.ndarray,
+               color_func: ColorFunc | None = None) -> Layout:
+        """Раскладывает слова по маске (255 — фон, остальное — область для слов)"""
+        rnd = random.Random(self.random_state)
+        rng = np.random.default_rng(self.random_state)
+        occupancy = Occupancy(mask)
+
+        ordered = sorted(frequencies.items(), key=lambda item: item[1], reverse=True)
+        ordered = [(word, freq) for word, freq in ordered if freq > 0]
+        if not ordered:
+            return Layout([], (occupancy.width, occupancy.height), self.font_path, self.scale,
+                          background_color=self.background_color)
+        max_freq = ordered[0][1]
+
+        placed: list[PlacedWord] = []
+        exhausted: set[str] = set()
+        font_size = self.max_font_size
+        last_freq = 1.0
+        while len(placed) < self.max_words:
+            placed_in_pass = 0
+            for word, freq in ordered:
+                if len(placed) >= self.max_words:
+                    break
+                freq /= max_freq
+                if self.relative_scaling:
+                    font_size = int(round((self.relative_scaling * (freq / last_freq)
+                                           + (1 - self.relative_scaling)) * font_size))
+                    font_size = min(font_size, self.max_font_size)
+
+                preferred = HORIZONTAL if rnd.random() < self.prefer_horizontal else VERTICAL
+                found = self._find_size(occupancy, word, font_size, preferred, rng)
+                if (found is None or found[0] < font_size) and self.prefer_horizontal < 1:
+                    other = VERTICAL if preferred is HORIZONTAL else HORIZONTAL
+                    found_other = self._find_size(occupancy, word, font_size, other, rng)
+                    if found_other is not None and (found is None or found_other[0] > found[0]):
+                        found, preferred = found_other, other
+                if found is None:
+                    # Не влезает даже минимальным шрифтом — и уже не влезет
+                    exhausted.add(word)
+                    continue
+
+                font_size, (y, x) = found
+                occupancy.place(y, x, measure(self.font_path, word, font_size, preferred, self.margin))
+                position = (x + self.margin, y + self.margin)
+                color = color_func(word=word, font_size=font_size, position=position,
+                                   orientation=preferred, random_state=rnd) if color_func else 'white'
+                placed.append(PlacedWord(word, font_size, position, preferred, color))
+                last_freq = freq
+                placed_in_pass += 1
+
+            if not self.repeat or not placed_in_pass:
+                break
+            # В повторных проходах слова идут с частотой последнего размещённого
+            ordered = [(word, last_freq * max_freq) for word, _ in ordered if word not in exhausted]
+
+        return Layout(placed, (occupancy.width, occupancy.height), self.font_path, self.scale,
+                      background_color=self.background_color)
@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+PATTERN_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MASK_CACHE_DIR = os.getenv("MASK_CACHE_DIR")
+
+
+MaskSize = tuple[int, int]
+
+
+def fit_size(source: MaskSize, target: MaskSize) -> MaskSize:
+    """Размер source, вписанный в target с сохранением пропорций"""
+    ratio = min(target[0] / source[0], target[1] / source[1])
+    return max(1, round(source[0] * ratio)), max(1, round(source[1] * ratio))
+
+
+def build_mask(pattern_path: str, size: MaskSize | None = None) -> np.ndarray:
+    """Строит маску WordCloud из паттерна: 0 — область для слов, 255 — фон.
+
+    Если задан size (ширина, высота), маска вписывается в него
+    с сохранением пропорций паттерна.
+    """
+    with Image.open(pattern_path) as img:
+        channel = img.getchannel('A') if img.mode == 'RGBA' else img.convert('L')
+    area = channel.point(lambda value: 255 if value == 255 else 0)
+
+    if size is not None:
+        fitted = fit_size(area.size, size)
+        if fitted != area.size:
+            # BOX усредняет исходные пиксели, поэтому тонкие детали формы не теряются
+            area = area.resize(fitted, Image.Resampling.BOX)
+            area = area.point(lambda value: 255 if value >= 128 else 0)
+
+    mask = np.where(np.asarray(area) == 255, 0, 255).astype(np.uint8)
+    mask.setflags(write=False)
+    return mask
+
+
+class MaskCache:
+    """Кэш масок паттернов на процесс.
+
+    Маска строится один раз для каждого размера холста и сбрасывается,
+    когда меняется mtime файла паттерна.
+    Если задан cache_dir, маски сохраняются в .npy и открываются через memmap,
+    так что воркеры на одной машине делят одни и те же страницы памяти.
+    """
+
+    def __init__(self, cache_dir: str | None = MASK_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._entries: dict[tuple[str, MaskSize | None], tuple[int, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, pattern_path: str, size: MaskSize | None = None) -> np.ndarray:
+        """Возвращает маску паттерна, вписанную в size (только для чтения)"""
+        path = os.path.abspath(pattern_path)
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, tuple(size) if size else None)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+
+            mask = self._load(path, mtime, key[1])
+            self._entries[key] = (mtime, mask)
+            logger.debug(f"Маска {pattern_path} загружена в кэш: {mask.shape}")
+            return mask
+
+    def _load(self, path: str, mtime: int, size: MaskSize | None) -> np.ndarray:
+        if not self.cache_dir:
+            return build_mask(path, size)
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        suffix = f"{size[0]}x{size[1]}" if size else "full"
+        npy_path = os.path.join(self.cache_dir, f"{name}-{mtime}-{suffix}.npy")
+        if not os.path.exists(npy_path):
+            mask = build_mask(path, size)
+            tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, mask)
+            os.replace(tmp_path, npy_path)
+            self._remove_stale(name, mtime)
+        return np.load(npy_path, mmap_mode='r')
+
+    def _remove_stale(self, name: str, mtime: int):
+        """Удаляет .npy от старых версий паттерна (любого размера)"""
+        for file in os.listdir(self.cache_dir):
+            if not (file.startswith(f"{name}-") and file.endswith('.npy')):
+                continue
+            stamp = file[len(name) + 1:-len('.npy')].split('-', 1)[0]
+            if stamp.isdigit() and int(stamp) != mtime:
+                try:
+                    os.remove(os.path.join(self.cache_dir, file))
+                except OSError:
+                    pass
+
+    def preload(self, patterns_dir: str = 'patterns', size: MaskSize | None = None) -> int:
+        """Заранее строит маски для всех паттернов каталога"""
+        count = 0
+        for file in sorted(os.listdir(patterns_dir)):
+            if file.lower().endswith(PATTERN_EXTENSIONS):
+                self.get(os.path.join(patterns_dir, file), size)
+                count += 1
+        logger.info(f"Предзагружено масок паттернов: {count}")
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Глобальный экземпляр
+mask_cache = MaskCache()
@@ -0,0 +1,68 @@
+import os
+import logging
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+from app.tokenizer import count_batch, iter_text_batches
+
+logger = logging.getLogger(__name__)
+
+PARALLEL_THRESHOLD = int(os.getenv("PARALLEL_COUNT_THRESHOLD_MB", "64")) * 1024 * 1024
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_COUNT_WORKERS", "0")) or os.cpu_count() or 1
+CHUNK_MESSAGES = 20000
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Возвращает общий для процесса пул воркеров подсчёта"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: форк многопоточного процесса бота может унаследовать захваченные блокировки
+            _executor = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info(f"Запущен пул подсчёта слов на {PARALLEL_WORKERS} процессов")
+        return _executor
+
+
+def _count_chunk(texts: list[str]) -> Counter:
+    return count_batch(texts, Counter())
+
+
+def count_texts_parallel(messages: Iterable[dict], counter: Counter | None = None,
+                         chunk_size: int = CHUNK_MESSAGES) -> Counter:
+    """Считает слова, раздавая пачки сообщений пулу процессов.
+
+    Частичные счётчики сливаются в порядке отправки, поэтому результат
+    (включая порядок равных частот в most_common) совпадает с последовательным подсчётом.
+    В полёте держится не больше двух пачек на воркер, так что память ограничена.
+    """
+    if counter is None:
+        counter = Counter()
+
+    executor = _get_executor()
+    pending = deque()
+    for chunk in iter_text_batches(messages, chunk_size):
+        if len(pending) >= PARALLEL_WORKERS * 2:
+            counter.update(pending.popleft().result())
+        pending.append(executor.submit(_count_chunk, chunk))
+
+    while pending:
+        counter.update(pending.popleft().result())
+    return counter
+
+
+def shutdown():
+    """Останавливает пул подсчёта"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
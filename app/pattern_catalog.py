@@ -0,0 +1,234 @@
+import io
+import os
+import time
+import zlib
+import logging
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.fonts import get_font
+from app.mask_cache import PATTERN_EXTENSIONS, MaskSize, build_mask, mask_cache
+
+logger = logging.getLogger(__name__)
+
+PATTERNS_DIR = 'patterns'
+# Как часто каталог паттернов проверяется на изменения (секунды)
+PATTERN_RELOAD_INTERVAL = float(os.getenv("PATTERN_RELOAD_INTERVAL", "2"))
+THUMBNAIL_SIZE = 128
+# Размер маски для площади и превью: точности хватает, а памяти нужно мало
+SUMMARY_SIZE = (512, 512)
+THUMBNAIL_COLOR = (231, 76, 60)
+SHEET_COLUMNS = 3
+
+# (имя файла, mtime_ns, размер) для каждого паттерна — по нему замечаются изменения
+_Listing = tuple[tuple[str, int, int], ...]
+
+
+class Pattern(NamedTuple):
+    name: str
+    file: str
+    path: str
+    mtime: int
+    # Размер исходного изображения (ширина, высота)
+    size: MaskSize
+    # Доля площади паттерна, которую занимают слова (0..1)
+    fill_area: float
+    # Маленькое PNG-превью формы
+    thumbnail: bytes
+
+
+class _State(NamedTuple):
+    version: str
+    patterns: list[Pattern]
+    by_file: dict[str, Pattern]
+
+
+class PatternCatalog:
+    """Список паттернов с заранее посчитанными площадью формы и превью.
+
+    Порядок постоянный (по имени файла), по нему нумеруются кнопки выбора.
+    Каталог перечитывается не чаще раза в PATTERN_RELOAD_INTERVAL секунд и
+    только если файлы в нём изменились; неизменившиеся паттерны не
+    пересчитываются. Маски под размер холста готовит preload и хранит
+    общий кэш масок. version меняется при каждом изменении списка —
+    по ней обработчики узнают, что пользователь выбирал из старого списка.
+    """
+
+    def __init__(self, patterns_dir: str = PATTERNS_DIR, reload_interval: float = PATTERN_RELOAD_INTERVAL):
+        self.patterns_dir = patterns_dir
+        self.reload_interval = reload_interval
+        self._listing: Optional[_Listing] = None
+        # Версия, список и индекс меняются одним присваиванием: читатель без
+        # блокировки видит либо старое состояние целиком, либо новое
+        self._state = _State('', [], {})
+        # (версия, PNG) — превью для конкретной версии каталога
+        self._sheet: Optional[tuple[str, bytes]] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> tuple[str, list[Pattern]]:
+        """Версия и паттерны одного и того же состояния каталога"""
+        self._maybe_reload()
+        state = self._state
+        return state.version, state.patterns
+
+    def patterns(self) -> list[Pattern]:
+        return self.snapshot()[1]
+
+    @property
+    def version(self) -> str:
+        return self.snapshot()[0]
+
+    def get(self, file: str) -> Optional[Pattern]:
+        """Паттерн по точному имени файла (heart.png и heart.jpg — разные паттерны)"""
+        self._maybe_reload()
+        return self._state.by_file.get(file)
+
+    def find(self, name: str) -> Optional[Pattern]:
+        """Паттерн по имени файла или по имени без расширения, если такой файл один"""
+        self._maybe_reload()
+        state = self._state
+        pattern = state.by_file.get(name)
+        if pattern is not None:
+            return pattern
+        matches = [pattern for pattern in state.patterns if pattern.name == name]
+        return matches[0] if len(matches) == 1 else None
+
+    def mask(self, file: str, size: Optional[MaskSize] = None) -> Optional[np.ndarray]:
+        """Маска паттерна, вписанная в size (через общий кэш масок)"""
+        pattern = self.get(file)
+        return None if pattern is None else mask_cache.get(pattern.path, size)
+
+    def preload(self, size: Optional[MaskSize] = None) -> int:
+        """Загружает каталог и готовит маски всех паттернов под размер холста"""
+        patterns = self.patterns()
+        for pattern in patterns:
+            mask_cache.get(pattern.path, size)
+        return len(patterns)
+
+    def sheet(self) -> Optional[bytes]:
+        """PNG со всеми превью, подписанными номерами кнопок"""
+        version, patterns = self.snapshot()
+        if not patterns:
+            return None
+        cached = self._sheet
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        sheet = _build_sheet(patterns)
+        self._sheet = (version, sheet)
+        return sheet
+
+    def reload(self, force: bool = False) -> bool:
+        """Перечитывает каталог, если он изменился; возвращает True при изменении"""
+        with self._lock:
+            self._checked = time.monotonic()
+            listing = self._scan()
+            if listing == self._listing and not force:
+                return False
+
+            previous = self._state.by_file
+            patterns = []
+            for file, mtime, _ in listing:
+                pattern = previous.get(file)
+                if pattern is None or pattern.mtime != mtime:
+                    try:
+                        pattern = _load_pattern(os.path.join(self.patterns_dir, file), mtime)
+                    except Exception as e:
+                        logger.error(f"Не удалось загрузить паттерн {file}: {e}")
+                        continue
+                patterns.append(pattern)
+
+            self._state = _State(
+                version=f"{zlib.crc32(repr(listing).encode()):08x}",
+                patterns=patterns,
+                by_file={pattern.file: pattern for pattern in patterns},
+            )
+            first_load = self._listing is None
+            self._listing = listing
+
+        if first_load:
+            logger.info(f"Загружено паттернов: {len(patterns)}")
+        else:
+            logger.info(f"Каталог паттернов обновлён: {', '.join(p.name for p in patterns)}")
+        return True
+
+    def _maybe_reload(self):
+        if self._listing is None or time.monotonic() - self._checked >= self.reload_interval:
+            try:
+                self.reload()
+            except OSError as e:
+                logger.error(f"Не удалось прочитать каталог паттернов {self.patterns_dir}: {e}")
+
+    def _scan(self) -> _Listing:
+        listing = []
+        for entry in os.scandir(self.patterns_dir):
+            if entry.name.lower().endswith(PATTERN_EXTENSIONS) and entry.is_file():
+                stat = entry.stat()
+                listing.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(listing))
+
+
+def _load_pattern(path: str, mtime: int) -> Pattern:
+    file = os.path.basename(path)
+    with Image.open(path) as img:
+        size = img.size
+    area = build_mask(path, SUMMARY_SIZE) == 0
+    return Pattern(
+        name=os.path.splitext(file)[0],
+        file=file,
+        path=path,
+        mtime=mtime,
+        size=size,
+        fill_area=float(area.mean()),
+        thumbnail=_encode(_thumbnail(area)),
+    )
+
+
+def _thumbnail(area: np.ndarray) -> Image.Image:
+    """Форма цветом на белом фоне, вписанная в квадрат THUMBNAIL_SIZE"""
+    shape = Image.fromarray(area.astype(np.uint8) * 255)
+    shape.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BOX)
+    image = Image.new('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE), 'white')
+    offset = ((THUMBNAIL_SIZE - shape.width) // 2, (THUMBNAIL_SIZE - shape.height) // 2)
+    image.paste(THUMBNAIL_COLOR, (*offset, offset[0] + shape.width, offset[1] + shape.height), shape)
+    return image
+
+
+def _build_sheet(patterns: list[Pattern]) -> bytes:
+    rows = (len(patterns) + SHEET_COLUMNS - 1) // SHEET_COLUMNS
+    sheet = Image.new('RGB', (SHEET_COLUMNS * THUMBNAIL_SIZE, rows * THUMBNAIL_SIZE), 'white')
+    draw = ImageDraw.Draw(sheet)
+    font = get_font(None, THUMBNAIL_SIZE // 6)
+    for index, pattern in enumerate(patterns):
+        x, y = index % SHEET_COLUMNS * THUMBNAIL_SIZE, index // SHEET_COLUMNS * THUMBNAIL_SIZE
+        with Image.open(io.BytesIO(pattern.thumbnail)) as thumbnail:
+            sheet.paste(thumbnail, (x, y))
+        draw.text((x + 6, y + 4), str(index + 1), fill='black', font=font)
+    return _encode(sheet)
+
+
+def _encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+_catalogs: dict[str, PatternCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(patterns_dir: str = PATTERNS_DIR) -> PatternCatalog:
+    """Каталог для папки паттернов, один на процесс"""
+    key = os.path.abspath(patterns_dir)
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.setdefault(key, PatternCatalog(patterns_dir))
+    return catalog
+
+
+# Глобальный экземпляр
+pattern_catalog = get_catalog()
@@ -0,0 +1,207 @@
+import os
+import signal
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_SIZE = int(os.getenv("RENDER_POOL_SIZE", "0")) or os.cpu_count() or 1
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120"))
+RENDER_MAX_JOBS = int(os.getenv("RENDER_MAX_JOBS", "50"))
+WORKER_START_TIMEOUT = 60
+
+
+class RenderError(Exception):
+    """Ошибка внутри воркера рендеринга"""
+
+
+class RenderTimeoutError(RenderError):
+    """Задача не уложилась в отведённое время, воркер остановлен"""
+
+
+def _worker_main(conn: Connection, patterns_dir: str):
+    """Цикл воркера: один раз прогревает библиотеки и маски, затем выполняет задачи"""
+    # Ctrl+C обрабатывает основной процесс, он же останавливает воркеры
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import get_photo
+
+    try:
+        get_photo.get_generator().preload_masks(patterns_dir)
+        get_photo.get_generator(get_photo.PREVIEW_CONFIG).preload_masks(patterns_dir)
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть воркер рендеринга: {e}")
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        func, kwargs = job
+        try:
+            conn.send(("ok", func(**kwargs)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Процесс-воркер и его канал связи"""
+
+    def __init__(self, ctx, patterns_dir: str):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, patterns_dir), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def wait_ready(self, timeout: float) -> bool:
+        try:
+            if not self.conn.poll(timeout):
+                return False
+            status, _ = self.conn.recv()
+        except (EOFError, OSError):
+            return False
+        return status == "ready"
+
+    def run(self, func: Callable, kwargs: dict, timeout: float):
+        """Выполняет задачу; при таймауте возвращает None вместо ответа"""
+        self.jobs += 1
+        self.conn.send((func, kwargs))
+        if not self.conn.poll(timeout):
+            return None
+        return self.conn.recv()
+
+    def stop(self, kill: bool = False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    """Пул заранее прогретых процессов для генерации изображений.
+
+    Каждый воркер один раз импортирует wordcloud/NumPy и загружает маски.
+    Задача, не уложившаяся в timeout, завершается вместе с процессом,
+    а воркер перезапускается после max_jobs задач, чтобы ограничить рост памяти.
+    """
+
+    def __init__(self, size: int = RENDER_POOL_SIZE, timeout: float = RENDER_TIMEOUT,
+                 max_jobs: int = RENDER_MAX_JOBS, patterns_dir: str = 'patterns'):
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.patterns_dir = patterns_dir
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue[_Worker] | None = None
+        self._workers: set[_Worker] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None
+
+    async def start(self):
+        """Запускает и прогревает все воркеры"""
+        async with self._start_lock:
+            if self._idle is not None:
+                return
+            self._idle = asyncio.Queue()
+            await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+            logger.info(f"Пул рендеринга запущен: {self.size} процессов")
+
+    async def _spawn(self):
+        worker = await asyncio.to_thread(_Worker, self._ctx, self.patterns_dir)
+        self._workers.add(worker)
+        ready = await asyncio.to_thread(worker.wait_ready, WORKER_START_TIMEOUT)
+        if self._idle is None:
+            # Пул закрыли, пока воркер запускался
+            self._retire(worker)
+        elif ready:
+            self._idle.put_nowait(worker)
+        else:
+            logger.error(f"Воркер рендеринга {worker.process.pid} не запустился")
+            self._retire(worker, kill=True)
+            # Вместо незапустившегося воркера пробуем поднять новый
+            await asyncio.sleep(5)
+            self._respawn()
+
+    def _respawn(self):
+        if self._idle is None:
+            return
+        task = asyncio.create_task(self._spawn())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _retire(self, worker: _Worker, kill: bool = False):
+        self._workers.discard(worker)
+        asyncio.get_running_loop().run_in_executor(None, worker.stop, kill)
+
+    async def submit(self, func: Callable, timeout: float | None = None, **kwargs) -> Any:
+        """Выполняет func(**kwargs) в свободном воркере и возвращает результат"""
+        if not self.started:
+            await self.start()
+        timeout = self.timeout if timeout is None else timeout
+
+        worker = await self._idle.get()
+        try:
+            reply = await asyncio.to_thread(worker.run, func, kwargs, timeout)
+        except asyncio.CancelledError:
+            # Отменённую задачу нельзя прервать иначе, чем остановив процесс
+            self._retire(worker, kill=True)
+            self._respawn()
+            raise
+        except (EOFError, OSError) as e:
+            logger.error(f"Воркер рендеринга {worker.process.pid} упал: {e}")
+            self._retire(worker, kill=True)
+            self._respawn()
+            raise RenderError("Воркер рендеринга неожиданно завершился") from e
+
+        if reply is None:
+            logger.warning(f"Задача в воркере {worker.process.pid} превысила {timeout} с, воркер остановлен")
+            self._retire(worker, kill=True)
+            self._respawn()
+            raise RenderTimeoutError(f"Генерация не уложилась в {timeout:.0f} с")
+
+        if worker.jobs >= self.max_jobs:
+            logger.debug(f"Воркер {worker.process.pid} выполнил {worker.jobs} задач, перезапуск")
+            self._retire(worker)
+            self._respawn()
+        else:
+            self._idle.put_nowait(worker)
+
+        status, result = reply
+        if status == "error":
+            raise RenderError(result)
+        return result
+
+    async def close(self):
+        """Останавливает все воркеры"""
+        for task in list(self._tasks):
+            task.cancel()
+        workers = list(self._workers)
+        self._workers.clear()
+        self._idle = None
+        await asyncio.gather(*(asyncio.to_thread(worker.stop) for worker in workers))
+        if workers:
+            logger.info("Пул рендеринга остановлен")
+
+
+# Глобальный экземпляр
+render_pool = RenderPool()
@@ -0,0 +1,80 @@
+import re
+from collections import Counter
+from itertools import islice
+from typing import Iterable, Iterator
+
+BATCH_SIZE = 2000
+MIN_WORD_LENGTH = 3
+TECH_WORDS = ('document_id', 'sticker', 'video_file', 'custom_emoji')
+
+# Все шаблоны компилируются один раз при импорте
+_TECH_RE = re.compile('|'.join(map(re.escape, TECH_WORDS)))
+_WORD_RE = re.compile(rf'[а-яё]{{{MIN_WORD_LENGTH},}}')
+_SEPARATOR = '\x00'
+
+
+def message_text(msg: dict) -> str:
+    """Возвращает текст сообщения, склеивая массив сущностей Telegram в строку"""
+    text = msg.get("text")
+    if isinstance(text, str):
+        return text
+    if isinstance(text, list):
+        return ''.join(
+            part if isinstance(part, str) else part.get("text", "")
+            for part in text
+            if isinstance(part, (str, dict))
+        )
+    return ""
+
+
+def iter_text_batches(messages: Iterable[dict], batch_size: int = BATCH_SIZE) -> Iterator[list[str]]:
+    """Группирует тексты сообщений в пачки по batch_size"""
+    texts = (message_text(msg) for msg in messages)
+    while True:
+        batch = list(islice(texts, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _drop_tech_messages(lowered: str) -> str:
+    """Вырезает из склеенной пачки сообщения, содержащие технические слова"""
+    parts = []
+    start = 0
+    for match in _TECH_RE.finditer(lowered):
+        if match.start() < start:
+            continue
+        message_start = lowered.rfind(_SEPARATOR, 0, match.start()) + 1
+        message_end = lowered.find(_SEPARATOR, match.end())
+        parts.append(lowered[start:message_start])
+        start = len(lowered) if message_end == -1 else message_end
+    parts.append(lowered[start:])
+    return ''.join(parts)
+
+
+def tokenize_batch(texts: list[str]) -> list[str]:
+    """Разбивает пачку текстов на слова одним проходом регулярного выражения.
+
+    Пачка склеивается и приводится к нижнему регистру целиком, сообщения
+    с техническими словами вырезаются из неё по найденным вхождениям.
+    """
+    lowered = _SEPARATOR.join(texts).lower()
+    if _TECH_RE.search(lowered):
+        lowered = _drop_tech_messages(lowered)
+    return _WORD_RE.findall(lowered)
+
+
+def count_batch(texts: list[str], counter: Counter) -> Counter:
+    """Добавляет слова пачки в счётчик"""
+    counter.update(tokenize_batch(texts))
+    return counter
+
+
+def count_texts(messages: Iterable[dict], counter: Counter | None = None,
+                batch_size: int = BATCH_SIZE) -> Counter:
+    """Считает слова во всех сообщениях потока пачками по batch_size"""
+    if counter is None:
+        counter = Counter()
+    for batch in iter_text_batches(messages, batch_size):
+        count_batch(batch, counter)
+    return counter
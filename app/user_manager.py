@@ -1,14 +1,119 @@
+import os
+import time
 import aiosqlite
 import logging
 import asyncio
-from typing import Optional
+from collections import OrderedDict
+from datetime import date
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple, Optional
 
 DB_PATH = "users.db"
+# Сколько пользователей держать в памяти и как долго доверять записи
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+# Как часто проверять, не писали ли в базу другие процессы бота (тогда кэш сбрасывается)
+USER_CACHE_CHECK_INTERVAL = float(os.getenv("USER_CACHE_CHECK_INTERVAL", "1"))
+# Соединения только для чтения, которые работают параллельно писателю
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Групповой коммит: сколько записей максимум и сколько секунд ждать попутчиков
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "256"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.005"))
+# Генераций в день для обычного пользователя
+DAILY_LIMIT = 3
 
 logger = logging.getLogger(__name__)
 
 
+def current_day() -> int:
+    """Номер текущего дня (по локальному времени сервера)"""
+    return date.today().toordinal()
+
+
+class UserState(NamedTuple):
+    admin: bool
+    limits: int
+    # День, к которому относится счётчик limits
+    limits_day: int
+    # Пользователь заблокировал бота — рассылки его пропускают
+    blocked: bool
+
+    def limits_on(self, day: int) -> int:
+        """Сколько генераций использовано в день day: счётчик прошлого дня не в счёт"""
+        return self.limits if self.limits_day == day else 0
+
+
+class UserCache:
+    """LRU-кэш состояний пользователей с ограниченным временем жизни записи.
+
+    Хранит и отсутствие пользователя (None), чтобы повторные запросы
+    незарегистрированных тоже не доходили до базы.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, Optional[UserState]]] = OrderedDict()
+        # Растёт при каждой записи: чтение, начатое раньше, не попадёт в кэш
+        self.generation = 0
+
+    def get(self, user_id: int) -> tuple[bool, Optional[UserState]]:
+        """Возвращает (найдено, состояние)"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires, state = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, state
+
+    def put(self, user_id: int, state: Optional[UserState], generation: Optional[int] = None):
+        if self.max_size <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, state)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, user_id: int, **changes):
+        """Меняет закэшированную запись, не продлевая её жизнь"""
+        self.generation += 1
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] is not None:
+            self._entries[user_id] = (entry[0], entry[1]._replace(**changes))
+
+    def invalidate(self, user_id: int):
+        self.generation += 1
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+class _Write(NamedTuple):
+    sql: str
+    params: tuple
+    future: asyncio.Future
+    # Вернуть строки (для запросов с RETURNING) вместо rowcount
+    returning: bool = False
+
+
 class UserManager:
+    """Доступ к базе пользователей.
+
+    Все изменения идут через одну задачу-писатель: она собирает накопившиеся
+    записи в одну транзакцию (групповой коммит), так что всплеск /start стоит
+    одного fsync, а не сотни. Чтения обслуживает пул соединений только для
+    чтения — в режиме WAL они не ждут писателя.
+
+    Кэш пользователей сбрасывается, когда базу изменил другой процесс
+    (PRAGMA data_version соединения-писателя), — не позже чем через
+    USER_CACHE_CHECK_INTERVAL секунд. Где нужна точность (допуск задачи
+    по лимитам), состояние читается из базы с fresh=True.
+    """
     _instance: Optional['UserManager'] = None
     _lock = asyncio.Lock()
     
@@ -20,151 +125,313 @@ class UserManager:
     def __init__(self, db_path: str = DB_PATH):
         if not hasattr(self, '_initialized'):
             self.db_path = db_path
+            self.readers = DB_READERS
+            self.write_batch_size = WRITE_BATCH_SIZE
+            self.write_batch_delay = WRITE_BATCH_DELAY
             self._initialized = False
             self._connection: Optional[aiosqlite.Connection] = None
+            self._readers: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+            self._writes: Optional[asyncio.Queue[Optional[_Write]]] = None
+            self._writer_task: Optional[asyncio.Task] = None
+            self._cache = UserCache()
+            self._data_version: Optional[int] = None
+            self._cache_checked = 0.0
 
-    async def _get_connection(self) -> aiosqlite.Connection:
-        """Возвращает единственное соединение с базой"""
-        if self._connection is None:
-            self._connection = await aiosqlite.connect(self.db_path)
-            await self._connection.execute("PRAGMA journal_mode=WAL")
-            logger.info("Создано новое соединение с БД")
-        return self._connection
+    async def _start(self):
+        """Открывает соединения и запускает писателя (один раз)"""
+        if self._writer_task is not None:
+            return
 
-    async def _initialize_db(self):
-        """Инициализирует базу данных"""
         async with self._lock:
-            if self._initialized:
+            if self._writer_task is not None:
                 return
-            
-            conn = await self._get_connection()
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    admin INTEGER DEFAULT 0,
-                    limits INTEGER DEFAULT 0
-                )
-            """)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_users_admin ON users(admin)
-            """)
-            await conn.commit()
-            self._initialized = True
-            logger.info("База данных инициализирована")
+            # Транзакции писатель открывает сам (BEGIN IMMEDIATE), см. _commit_batch
+            conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await self._initialize_db(conn)
+
+            readers = asyncio.Queue()
+            for _ in range(max(self.readers, 1)):
+                reader = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True)
+                await reader.execute("PRAGMA query_only=1")
+                readers.put_nowait(reader)
+
+            self._connection = conn
+            self._readers = readers
+            self._writes = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+            logger.info(f"Создано соединение с БД для записи и {readers.qsize()} для чтения")
+
+    async def _initialize_db(self, conn: aiosqlite.Connection):
+        """Инициализирует базу данных"""
+        if self._initialized:
+            return
+
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                admin INTEGER DEFAULT 0,
+                limits INTEGER DEFAULT 0,
+                limits_day INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0
+            )
+        """)
+        async with conn.execute("PRAGMA table_info(users)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        # Колонки, которых нет в базах старых версий. У старых счётчиков
+        # limits_day = 0, поэтому они считаются вчерашними
+        for column in ('limits_day', 'blocked'):
+            if column not in columns:
+                await conn.execute(f"ALTER TABLE users ADD COLUMN {column} INTEGER DEFAULT 0")
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_admin ON users(admin)
+        """)
+        await conn.commit()
+        self._initialized = True
+        logger.info("База данных инициализирована")
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Берёт свободное соединение для чтения из пула"""
+        await self._start()
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        """Читает одну строку через пул соединений для чтения"""
+        async with self._reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Читает все строки через пул соединений для чтения"""
+        async with self._reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def write(self, sql: str, params: tuple = ()) -> int:
+        """Ставит запись в очередь писателя и ждёт коммита; возвращает rowcount"""
+        await self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait(_Write(sql, params, future))
+        return await future
+
+    async def write_returning(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Как write, но возвращает строки RETURNING после коммита"""
+        await self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait(_Write(sql, params, future, returning=True))
+        return await future
+
+    async def _writer_loop(self):
+        """Единственный писатель: выполняет записи пачками, по коммиту на пачку"""
+        stopping = False
+        while not stopping:
+            item = await self._writes.get()
+            if item is None:
+                break
+            batch = [item]
+            stopping = self._drain(batch)
+            if not stopping and len(batch) < self.write_batch_size and self.write_batch_delay > 0:
+                # Даём попутчикам немного времени — задержка записи ограничена этим окном
+                await asyncio.sleep(self.write_batch_delay)
+                stopping = self._drain(batch)
+            await self._commit_batch(batch)
+
+    def _drain(self, batch: list[_Write]) -> bool:
+        """Добирает в пачку уже ждущие записи; True, если пришла команда остановки"""
+        while len(batch) < self.write_batch_size:
+            try:
+                item = self._writes.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _commit_batch(self, batch: list[_Write]):
+        conn = self._connection
+        results = []
+        try:
+            # IMMEDIATE сразу берёт блокировку записи: другой процесс бота с той же
+            # базой подождёт busy_timeout, а не получит SQLITE_BUSY посреди пачки
+            await conn.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                try:
+                    cursor = await conn.execute(write.sql, write.params)
+                    results.append(await cursor.fetchall() if write.returning else cursor.rowcount)
+                    await cursor.close()
+                except Exception as e:
+                    # Ошибка одной записи не должна откатывать чужие
+                    results.append(e)
+            await conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка группового коммита ({len(batch)} записей): {e}", exc_info=True)
+            try:
+                await conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            results = [e] * len(batch)
+
+        for write, result in zip(batch, results):
+            if write.future.done():
+                continue
+            if isinstance(result, Exception):
+                write.future.set_exception(result)
+            else:
+                write.future.set_result(result)
+
+    async def _check_cache(self):
+        """Сбрасывает кэш, если с прошлой проверки базу менял другой процесс.
+
+        data_version соединения меняется только от чужих коммитов, так что
+        собственные записи (их кэш учитывает сам) сброса не вызывают.
+        """
+        now = time.monotonic()
+        if now - self._cache_checked < USER_CACHE_CHECK_INTERVAL:
+            return
+        self._cache_checked = now
+        await self._start()
+        async with self._connection.execute("PRAGMA data_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if self._data_version is not None and version != self._data_version:
+            self._cache.clear()
+            logger.debug("База изменена другим процессом, кэш пользователей сброшен")
+        self._data_version = version
+
+    async def get_state(self, user_id: int, fresh: bool = False) -> Optional[UserState]:
+        """Возвращает флаг админа и лимиты пользователя (None, если его нет в базе).
+
+        fresh=True читает из базы в обход кэша.
+        """
+        await self._check_cache()
+        if not fresh:
+            found, state = self._cache.get(user_id)
+            if found:
+                return state
+
+        generation = self._cache.generation
+        row = await self.fetchone(
+            "SELECT admin, limits, limits_day, blocked FROM users WHERE id = ?", (user_id,))
+        state = UserState(bool(row[0]), row[1], row[2], bool(row[3])) if row else None
+        self._cache.put(user_id, state, generation)
+        return state
 
     async def is_new_user(self, user_id: int) -> bool:
         """Проверяет, новый ли пользователь"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        async with conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row is None
+        return await self.get_state(user_id) is None
 
     async def is_admin(self, user_id: int) -> bool:
         """Проверяет, является ли пользователь админом"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        async with conn.execute("SELECT admin FROM users WHERE id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return bool(row[0]) if row else False
+        state = await self.get_state(user_id)
+        return state is not None and state.admin
 
     async def get_users(self) -> list[int]:
         """Возвращает список всех пользователей"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        async with conn.execute("SELECT id FROM users") as cursor:
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+        rows = await self.fetchall("SELECT id FROM users")
+        return [row[0] for row in rows]
 
     async def add_user(self, user_id: int, admin: bool = False):
         """Добавляет нового пользователя (если его ещё нет)"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        await conn.execute(
+        await self.write(
             "INSERT OR IGNORE INTO users (id, admin) VALUES (?, ?)",
             (user_id, int(admin))
         )
-        await conn.commit()
+        self._cache.invalidate(user_id)
 
     async def add_admin(self, user_id: int):
         """Назначает пользователя админом"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        await conn.execute(
+        await self.write(
             "UPDATE users SET admin = 1 WHERE id = ?",
             (user_id,)
         )
-        await conn.commit()
+        self._cache.update(user_id, admin=True)
 
     async def remove_admin(self, user_id: int):
         """Снимает права админа"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        await conn.execute(
+        await self.write(
             "UPDATE users SET admin = 0 WHERE id = ?",
             (user_id,)
         )
-        await conn.commit()
+        self._cache.update(user_id, admin=False)
     
+    async def set_blocked(self, user_id: int, blocked: bool = True):
+        """Отмечает, что пользователь заблокировал бота (или вернулся)"""
+        state = await self.get_state(user_id)
+        if state is None or state.blocked == blocked:
+            return
+        await self.write(
+            "UPDATE users SET blocked = ? WHERE id = ?",
+            (int(blocked), user_id)
+        )
+        self._cache.update(user_id, blocked=blocked)
+
     async def get_balance(self, user_id: int) -> int:
         """Проверяет, баланс пользователя"""
-        await self._initialize_db()
-        conn = await self._get_connection()
-        async with conn.execute("SELECT balance FROM users WHERE id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
+        row = await self.fetchone("SELECT balance FROM users WHERE id = ?", (user_id,))
         print(row)
         return row[0]
     
-    async def get_limits(self, user_id: int, counts: bool = False) -> bool | int:
-        """Проверяет, есть ли у пользователя лимиты или возвращает их"""
-
-        await self._initialize_db()
-        conn = await self._get_connection()
-        async with conn.execute("SELECT limits FROM users WHERE id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            
+    async def get_limits(self, user_id: int, counts: bool = False, fresh: bool = False) -> bool | int:
+        """Проверяет, есть ли у пользователя лимиты или возвращает их.
+
+        Счётчик привязан к дню: в первый запрос нового дня он читается как 0,
+        поэтому ночной сброс по всей таблице не нужен. fresh=True — в обход кэша.
+        """
+        state = await self.get_state(user_id, fresh=fresh)
+        used = state.limits_on(current_day()) if state else 0
+
         if counts:
-            return row[0]
-        
-        if await self.is_admin(user_id=user_id):
-            return True
-         
-        if row is None:
+            return used
+
+        if state is None:
             return False
-        return row[0] < 3
+        return state.admin or used < DAILY_LIMIT
         
     async def increment_limits(self, user_id: int) -> None:
         """Увеличивает счётчик использованных лимитов"""
         try:
-            await self._initialize_db()
-            conn = await self._get_connection()
-            await conn.execute(
-                "UPDATE users SET limits = limits + 1 WHERE id = ?",
-                (user_id,)
+            today = current_day()
+            await self.write(
+                """UPDATE users
+                   SET limits = CASE WHEN limits_day = ? THEN limits + 1 ELSE 1 END,
+                       limits_day = ?
+                   WHERE id = ?""",
+                (today, today, user_id)
             )
-            await conn.commit()
+            found, state = self._cache.get(user_id)
+            if found and state is not None:
+                self._cache.update(user_id, limits=state.limits_on(today) + 1, limits_day=today)
         except Exception as e:
             logger.error(f"Ошибка при увеличении лимитов: {e}")
     
-    async def reset_all_limits(self) -> bool:
-        """Сбрасывает все лимиты пользователей"""
-        try:
-            await self._initialize_db()
-            conn = await self._get_connection()
-            await conn.execute("UPDATE users SET limits = 0")
-            await conn.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при сбросе лимитов: {e}")
-            return False
-    
     async def close(self):
-        """Закрывает соединение с БД"""
-        if self._connection:
-            await self._connection.close()
-            self._connection = None
-            self._initialized = False
-            logger.info("Соединение с БД закрыто")
+        """Дописывает очередь и закрывает соединения с БД"""
+        if self._writer_task is None:
+            return
+        self._writes.put_nowait(None)
+        await self._writer_task
+        while not self._writes.empty():
+            item = self._writes.get_nowait()
+            if item is not None and not item.future.done():
+                item.future.set_exception(RuntimeError("Соединение с БД закрыто"))
+        await self._connection.close()
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        self._writer_task = None
+        self._connection = None
+        self._readers = None
+        self._writes = None
+        self._initialized = False
+        self._cache.clear()
+        self._data_version = None
+        self._cache_checked = 0.0
+        logger.info("Соединение с БД закрыто")
 
 
 # Глобальный экземпляр
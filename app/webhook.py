@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+async def start_webhook_server(dp: Dispatcher, bot: Bot, host: str, port: int, path: str,
+                               secret_token: Optional[str] = None, **data) -> web.AppRunner:
+    """Поднимает aiohttp-сервер, принимающий обновления на path.
+
+    Обновление подтверждается ответом 200 сразу после разбора, а обработчики
+    выполняются в фоновых задачах — медленная генерация не задерживает
+    доставку следующих обновлений. Порт открывается с SO_REUSEPORT, поэтому
+    несколько процессов бота могут слушать один порт (или каждый свой —
+    за локальным reverse proxy).
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=secret_token,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot, **data)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает http://{host}:{port}{path}")
+    return runner
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, host: str, port: int, path: str,
+                      secret_token: Optional[str] = None, register: bool = True):
+    """Работает в режиме webhook до отмены"""
+    runner = await start_webhook_server(dp, bot, host, port, path, secret_token)
+    try:
+        if register:
+            await bot.set_webhook(
+                url.rstrip('/') + path,
+                secret_token=secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info(f"Webhook зарегистрирован: {url.rstrip('/')}{path}")
+        await asyncio.Event().wait()
+    finally:
+        # Webhook не удаляется: другие процессы за прокси продолжают его обслуживать
+        await runner.cleanup()
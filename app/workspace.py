@@ -0,0 +1,161 @@
+import os
+import time
+import shutil
+import socket
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Рабочие каталоги задач по возможности в памяти (tmpfs): архив и распаковка не ходят на диск
+WORKSPACE_TMPFS = os.getenv("WORKSPACE_TMPFS", "1") != "0"
+TMPFS_DIR = os.getenv("WORKSPACE_TMPFS_DIR", "/dev/shm/valentine")
+# Каталог на диске, если tmpfs нет или на нём мало места
+WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", "temp")
+# Задача занимает до MAX_UPLOAD_SIZE_MB под архив; при меньшем запасе в памяти — на диск
+WORKSPACE_RESERVE = int(os.getenv("WORKSPACE_RESERVE_MB", "256")) * 1024 * 1024
+# Каталог живого процесса старше этого срока тоже считается брошенным (с запасом к JOB_LEASE)
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", "3600"))
+WORKSPACE_SWEEP_INTERVAL = float(os.getenv("WORKSPACE_SWEEP_INTERVAL", "300"))
+
+# Имя каталога: job@pid@хост@задача@случайный суффикс ("@" не встречается ни в хосте, ни в суффиксе)
+_PREFIX = "job"
+_SEP = "@"
+
+
+class WorkspaceManager:
+    """Отдельный рабочий каталог на каждую задачу.
+
+    Каталог создаётся под задачу и удаляется целиком, когда она завершилась,
+    так что одновременные задачи не пересекаются по именам файлов. В имени
+    каталога записаны хост и pid владельца: фоновая чистка сразу удаляет
+    каталоги умерших процессов этого хоста, а остальные — по возрасту.
+    """
+
+    def __init__(self, tmpfs_dir: Optional[str] = TMPFS_DIR if WORKSPACE_TMPFS else None,
+                 disk_dir: str = WORKSPACE_DIR, reserve: int = WORKSPACE_RESERVE,
+                 max_age: float = WORKSPACE_MAX_AGE):
+        self.tmpfs_dir = tmpfs_dir
+        self.disk_dir = disk_dir
+        self.reserve = reserve
+        self.max_age = max_age
+        self.host = socket.gethostname()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @property
+    def roots(self) -> list[str]:
+        return [root for root in (self.tmpfs_dir, self.disk_dir) if root]
+
+    def _root(self) -> str:
+        """tmpfs, если он есть и на нём хватает места, иначе каталог на диске"""
+        if self.tmpfs_dir and os.path.isdir(os.path.dirname(self.tmpfs_dir) or '.'):
+            try:
+                os.makedirs(self.tmpfs_dir, exist_ok=True)
+                stat = os.statvfs(self.tmpfs_dir)
+                if stat.f_bavail * stat.f_frsize >= self.reserve:
+                    return self.tmpfs_dir
+                logger.warning(f"В {self.tmpfs_dir} мало места, рабочий каталог задачи создаётся на диске")
+            except OSError as e:
+                logger.warning(f"tmpfs {self.tmpfs_dir} недоступен: {e}")
+        os.makedirs(self.disk_dir, exist_ok=True)
+        return self.disk_dir
+
+    def create(self, name: str = "") -> str:
+        """Создаёт новый пустой каталог задачи и возвращает путь к нему"""
+        prefix = _SEP.join((_PREFIX, str(os.getpid()), self.host, name, ""))
+        return tempfile.mkdtemp(prefix=prefix, dir=self._root())
+
+    def remove(self, path: str):
+        size = _dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        logger.debug(f"Рабочий каталог {path} удалён, занимал {size} байт")
+
+    @asynccontextmanager
+    async def job(self, name: str = "") -> AsyncIterator[str]:
+        """Рабочий каталог на время задачи; удаляется при любом её исходе"""
+        path = await asyncio.to_thread(self.create, str(name))
+        try:
+            yield path
+        finally:
+            # shield: при отмене задачи каталог всё равно убирается сразу, а не чисткой
+            await asyncio.shield(asyncio.to_thread(self.remove, path))
+
+    def sweep(self) -> int:
+        """Удаляет каталоги, оставшиеся после падений; возвращает их число"""
+        removed = 0
+        now = time.time()
+        for root in self.roots:
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.name.startswith(_PREFIX + _SEP) or not entry.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    age = now - entry.stat(follow_symlinks=False).st_mtime
+                except FileNotFoundError:
+                    continue
+                if age > self.max_age or self._owner_dead(entry.name):
+                    self.remove(entry.path)
+                    removed += 1
+        if removed:
+            logger.info(f"Удалено брошенных рабочих каталогов: {removed}")
+        return removed
+
+    def _owner_dead(self, name: str) -> bool:
+        parts = name.split(_SEP)
+        if len(parts) != 5 or not parts[1].isdigit():
+            return False
+        pid, host = int(parts[1]), parts[2]
+        # Процессы других хостов (общий каталог на диске) отсюда не проверить
+        if host != self.host or pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    async def start(self, interval: float = WORKSPACE_SWEEP_INTERVAL):
+        """Чистит остатки прошлых запусков и запускает периодическую чистку"""
+        if self._sweeper is not None:
+            return
+        await asyncio.to_thread(self.sweep)
+        self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+        logger.info(f"Рабочие каталоги задач: {self._root()}")
+
+    async def close(self):
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        await asyncio.gather(self._sweeper, return_exceptions=True)
+        self._sweeper = None
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Ошибка при чистке рабочих каталогов: {e}", exc_info=True)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+# Глобальный экземпляр
+workspaces = WorkspaceManager()
@@ -0,0 +1,82 @@
+"""Сравнение пропускной способности токенизатора со старым циклом get_all_msg.
+
+Запуск: python benchmarks/bench_tokenizer.py [кол-во сообщений]
+"""
+import random
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.tokenizer import count_texts
+
+VOCABULARY = (
+    "привет как дела хорошо спасибо люблю тебя очень сильно скучаю котик солнышко "
+    "сегодня завтра вечером утром встретимся позвони напиши когда будешь дома работа"
+).split()
+
+
+def make_messages(count: int, seed: int = 42) -> list[dict]:
+    """Синтетические сообщения: строки, массивы сущностей и технические записи"""
+    rnd = random.Random(seed)
+    messages = []
+    for i in range(count):
+        words = ' '.join(rnd.choices(VOCABULARY, k=rnd.randint(1, 15)))
+        kind = rnd.random()
+        if kind < 0.6:
+            text = words.capitalize() + '!'
+        elif kind < 0.9:
+            text = [words, {"type": "link", "text": "https://t.me/x"}, {"type": "bold", "text": " Очень важно"}]
+        elif kind < 0.91:
+            text = f"{words} sticker document_id"
+        else:
+            text = ""
+        messages.append({"id": i, "type": "message", "text": text})
+    return messages
+
+
+def legacy_count(messages: list[dict]) -> Counter:
+    """Цикл из get_all_msg до выделения токенизатора"""
+    all_words = []
+    for msg in messages:
+        if isinstance(msg.get("text"), str):
+            text = msg["text"].strip()
+            if text and not any(tech_word in text.lower() for tech_word in
+                                ['document_id', 'sticker', 'video_file', 'custom_emoji']):
+                clean_text = re.sub(r'[^а-яё\s]', ' ', text.lower())
+                words = clean_text.split()
+                filtered_words = [word for word in words if len(word) >= 3]
+                all_words.extend(filtered_words)
+    return Counter(all_words)
+
+
+def measure(func, messages: list[dict], repeats: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(messages)
+        best = min(best, time.perf_counter() - started)
+    return len(messages) / best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    messages = make_messages(count)
+
+    plain = [msg for msg in messages if isinstance(msg["text"], str)]
+
+    print(f"Сообщений: {count} (строковых: {len(plain)})")
+    for title, sample in (("Только строки", plain), ("Строки и сущности", messages)):
+        legacy = measure(legacy_count, sample)
+        tokenizer = measure(count_texts, sample)
+        print(f"{title}:")
+        print(f"  старый цикл:  {legacy:,.0f} сообщ./с")
+        print(f"  токенизатор:  {tokenizer:,.0f} сообщ./с (x{tokenizer / legacy:.2f})")
+    print("Старый цикл пропускает сообщения с массивами сущностей, токенизатор их разбирает")
+
+
+if __name__ == "__main__":
+    main()
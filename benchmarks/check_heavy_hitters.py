@@ -0,0 +1,65 @@
+"""Проверка приближённого top-200 (SpaceSaving) против точного Counter.
+
+Генерирует переписки с частотами слов по закону Ципфа и сравнивает
+верхушку частот. Запуск: python benchmarks/check_heavy_hitters.py
+"""
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.heavy_hitters import SpaceSaving
+from app.tokenizer import count_texts
+from benchmarks.synthetic_export import iter_messages
+from get_msg import TOP_WORDS
+
+
+def run(count: int, vocabulary_size: int, exponent: float, seed: int) -> bool:
+    messages = list(islice(iter_messages(vocabulary_size, exponent, seed), count))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    exact = count_texts(messages, Counter())
+    exact_time = time.perf_counter() - started
+    exact_peak = tracemalloc.get_traced_memory()[1]
+
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    sketch = count_texts(messages, SpaceSaving())
+    sketch_time = time.perf_counter() - started
+    sketch_peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    exact_top = exact.most_common(TOP_WORDS)
+    sketch_top = sketch.most_common(TOP_WORDS)
+    same_words = [w for w, _ in exact_top] == [w for w, _ in sketch_top]
+    same_set = {w for w, _ in exact_top} == {w for w, _ in sketch_top}
+    max_error = max(sketch[w] - exact[w] for w, _ in sketch_top)
+
+    print(f"сообщений={count} словарь={vocabulary_size} s={exponent} seed={seed}")
+    print(f"  Counter:     {exact_time:.2f} с, пик {exact_peak / 1024:.0f} KB, уникальных слов {len(exact)}")
+    print(f"  SpaceSaving: {sketch_time:.2f} с, пик {sketch_peak / 1024:.0f} KB, слов в сводке {len(sketch)}")
+    print(f"  top-{TOP_WORDS}: набор {'совпадает' if same_set else 'РАЗЛИЧАЕТСЯ'}, "
+          f"порядок {'совпадает' if same_words else 'различается'}, "
+          f"макс. завышение {max_error} (граница {sketch.error_bound:.1f})")
+    return same_set
+
+
+def main():
+    cases = [
+        (200_000, 30_000, 1.0, 1),
+        (200_000, 100_000, 1.1, 2),
+        (500_000, 300_000, 0.9, 3),
+    ]
+    results = [run(*case) for case in cases]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Масштабирование очереди генераций по процессам.
+
+Ставит --jobs задач в общую таблицу jobs и запускает --processes процессов
+с app.job_queue.JobQueue на одной базе. Обработчик задачи либо рисует
+облако (get_photo.render_pattern, --work render), либо просто ждёт
+(--work sleep — проверка координации без нагрузки на CPU). Печатает
+время от начала первой задачи до конца последней (запуск процессов не
+в счёт) и сколько задач взял каждый процесс; каждая задача должна
+выполниться ровно один раз.
+
+Запуск: python benchmarks/job_queue_scaling.py --processes 1 2 4 --jobs 40
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+PATTERN = 'Сердце.png'
+
+
+def _worker(db_path: str, work: str, concurrency: int, done_path: str):
+    os.chdir(ROOT)
+    from app.job_queue import JobQueue
+    from app.user_manager import UserManager
+
+    words = None
+    if work == 'render':
+        import get_photo
+        from benchmarks.synthetic_export import iter_messages
+        messages = iter_messages()
+        words = []
+        while len(words) < 20000:
+            message = next(messages)
+            if isinstance(message['text'], str):
+                words.extend(message['text'].lower().split())
+        get_photo.get_generator().preload_masks()
+
+    async def handle(bot, job):
+        started = time.time()
+        if work == 'render':
+            await asyncio.to_thread(get_photo.render_pattern, words, job.pattern, seed=job.id)
+        else:
+            await asyncio.sleep(0.1)
+        with open(done_path, 'a') as file:
+            file.write(f"{job.id} {os.getpid()} {started} {time.time()}\n")
+
+    async def main():
+        manager = UserManager()
+        manager.db_path = db_path
+        queue = JobQueue(manager, max_concurrent=concurrency)
+        queue.register(handle)
+        await queue.start(bot=None)
+        while True:
+            await asyncio.sleep(0.2)
+            row = await manager.fetchone("SELECT COUNT(*) FROM jobs")
+            if row[0] == 0 and queue.running == 0:
+                break
+        await queue.close()
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def run(processes: int, jobs: int, work: str, concurrency: int) -> tuple[float, dict[int, int]]:
+    with tempfile.TemporaryDirectory(prefix='bench-jobs-') as tmp:
+        db_path = os.path.join(tmp, 'users.db')
+        done_path = os.path.join(tmp, 'done.txt')
+
+        async def fill():
+            from app.job_queue import JobQueue
+            from app.user_manager import UserManager
+            manager = UserManager()
+            manager.db_path = db_path
+            queue = JobQueue(manager, max_queue=jobs)
+            for user_id in range(1, jobs + 1):
+                await queue.submit(user_id, f"file-{user_id}", PATTERN)
+            await manager.close()
+
+        asyncio.run(fill())
+
+        ctx = multiprocessing.get_context('spawn')
+        workers = [ctx.Process(target=_worker, args=(db_path, work, concurrency, done_path))
+                   for _ in range(processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+
+        per_process: dict[int, int] = {}
+        seen = set()
+        first_start, last_end = float('inf'), 0.0
+        with open(done_path) as file:
+            for line in file:
+                job_id, pid, start, end = line.split()
+                job_id, pid = int(job_id), int(pid)
+                first_start = min(first_start, float(start))
+                last_end = max(last_end, float(end))
+                if job_id in seen:
+                    raise RuntimeError(f"Задача {job_id} выполнена дважды")
+                seen.add(job_id)
+                per_process[pid] = per_process.get(pid, 0) + 1
+        if len(seen) != jobs:
+            raise RuntimeError(f"Выполнено {len(seen)} задач из {jobs}")
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+        return last_end - first_start, per_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--jobs', type=int, default=40)
+    parser.add_argument('--work', choices=('render', 'sleep'), default='render')
+    parser.add_argument('--concurrency', type=int, default=1, help="задач одновременно в процессе")
+    args = parser.parse_args()
+
+    print(f"Ядер: {os.cpu_count()}")
+    for processes in args.processes:
+        seconds, per_process = run(processes, args.jobs, args.work, args.concurrency)
+        print(f"{processes} процесс(ов): {args.jobs} задач за {seconds:.2f} с "
+              f"({args.jobs / seconds:.1f} задач/с), по процессам {sorted(per_process.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Сквозной бенчмарк конвейера «экспорт → PNG».
+
+Каждая стадия запускается в отдельном процессе, чтобы пик RSS относился
+только к ней: распаковка (app.decoder.extract_zip), разбор и подсчёт слов
+(get_msg.get_all_msg, обычный и потоковый), загрузка маски, раскладка
+(app.layout_engine или BaseWordCloud.generate_from_frequencies), отрисовка и кодирование PNG
+(DenseWordCloudGenerator.encode_png) — для каждой формы из patterns/.
+
+Результат — JSON, который можно сравнить с прогоном на другом коммите:
+    python benchmarks/run_pipeline.py --output before.json
+    python benchmarks/run_pipeline.py --output after.json --baseline before.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic_export import write_export, write_zip
+
+DEFAULT_SIZES = [1, 10, 100, 500]
+QUICK_SIZES = [1, 10]
+
+_temp_dirs: list[str] = []
+
+
+def _make_temp_dir(prefix: str) -> str:
+    path = tempfile.mkdtemp(prefix=prefix)
+    _temp_dirs.append(path)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _setup_stage(stage: str, params: dict):
+    """Готовит входные данные стадии (без замера) и возвращает замеряемую функцию"""
+    os.chdir(ROOT)
+
+    if stage == 'extract':
+        from app.decoder import extract_zip
+        workdir = _make_temp_dir('bench-extract-')
+        return lambda: extract_zip(params['zip_path'], workdir)
+
+    if stage in ('parse', 'parse_stream'):
+        from get_msg import get_all_msg
+        return lambda: get_all_msg(params['json_path'], stream=stage == 'parse_stream')
+
+    import get_photo
+    from app.mask_cache import build_mask
+    config = {**get_photo.DEFAULT_CONFIG, 'layout_scale': params.get('layout_scale', 1),
+              'engine': params.get('engine', get_photo.DEFAULT_CONFIG['engine'])}
+    generator = get_photo.get_generator(config)
+    if stage == 'mask':
+        return lambda: build_mask(params['pattern_path'], generator.layout_size)
+
+    mask = build_mask(params['pattern_path'], generator.layout_size)
+    if stage == 'layout':
+        return lambda: generator.build_wordcloud(params['words'], mask)
+
+    wordcloud = generator.build_wordcloud(params['words'], mask)
+    if stage == 'draw':
+        return wordcloud.to_image
+
+    image = wordcloud.to_image()
+    if stage == 'encode':
+        return lambda: generator.encode_png(image)
+
+    raise ValueError(f"Неизвестная стадия: {stage}")
+
+
+def _stage_process(conn, stage: str, params: dict):
+    # stdout занят JSON-отчётом, служебный вывод модулей уходит в stderr
+    sys.stdout = sys.stderr
+    try:
+        func = _setup_stage(stage, params)
+        rss_before = _peak_rss_mb()
+        started = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - started
+        conn.send({'seconds': seconds, 'peak_rss_mb': _peak_rss_mb(),
+                   'setup_rss_mb': rss_before})
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+        for path in _temp_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def run_stage(stage: str, **params) -> dict:
+    """Запускает стадию в свежем процессе и возвращает замер"""
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_stage_process, args=(child_conn, stage, params))
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv() if parent_conn.poll(3600) else {'error': 'timeout'}
+    process.join()
+    return result
+
+
+def prepare_exports(sizes: list[float], data_dir: Path) -> dict[float, tuple[str, str]]:
+    """Создаёт (или берёт из кэша) синтетические экспорты нужных размеров"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    exports = {}
+    for size in sizes:
+        json_path = data_dir / f"export-{size:g}mb.json"
+        zip_path = data_dir / f"export-{size:g}mb.zip"
+        if not json_path.exists():
+            print(f"Генерация экспорта {size:g} MB...", file=sys.stderr)
+            write_export(str(json_path), size)
+            zip_path.unlink(missing_ok=True)
+        if not zip_path.exists():
+            write_zip(str(json_path), str(zip_path))
+        exports[size] = (str(json_path), str(zip_path))
+    return exports
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list[float], data_dir: Path, shapes: list[str] | None,
+        layout_scales: list[float], engines: list[str]) -> dict:
+    exports = prepare_exports(sizes, data_dir)
+    results = []
+
+    def record(stage: str, **fields):
+        params = fields.pop('params')
+        measurement = run_stage(stage, **params)
+        entry = {'stage': stage, **fields, **measurement}
+        results.append(entry)
+        status = entry.get('error') or f"{entry['seconds']:.3f} с, пик RSS {entry['peak_rss_mb']:.0f} MB"
+        label = ' '.join(f"{k}={v}" for k, v in fields.items())
+        print(f"{stage:<13} {label:<48} {status}", file=sys.stderr)
+
+    for size, (json_path, zip_path) in exports.items():
+        record('extract', size_mb=size, params={'zip_path': zip_path})
+        record('parse', size_mb=size, params={'json_path': json_path})
+        record('parse_stream', size_mb=size, params={'json_path': json_path})
+
+    from get_msg import get_all_msg
+    _, most_common = get_all_msg(exports[min(exports)][0], stream=True)
+    words = [word for word, _ in most_common]
+
+    patterns_dir = ROOT / 'patterns'
+    for pattern in sorted(patterns_dir.iterdir()):
+        if pattern.suffix.lower() != '.png' or (shapes and pattern.stem not in shapes):
+            continue
+        for engine in engines:
+            for layout_scale in layout_scales:
+                params = {'pattern_path': str(pattern), 'words': words,
+                          'layout_scale': layout_scale, 'engine': engine}
+                for stage in ('mask', 'layout', 'draw', 'encode'):
+                    record(stage, shape=pattern.stem, engine=engine, layout_scale=layout_scale, params=params)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def _key(entry: dict) -> tuple:
+    return (entry['stage'], entry.get('size_mb'), entry.get('shape'),
+            entry.get('engine'), entry.get('layout_scale', 1))
+
+
+def compare(report: dict, baseline: dict):
+    """Печатает изменение времени и памяти относительно прошлого прогона"""
+    previous = {_key(entry): entry for entry in baseline['results']}
+    print(f"Сравнение с {baseline['meta'].get('commit')}:", file=sys.stderr)
+    for entry in report['results']:
+        old = previous.get(_key(entry))
+        if not old or 'seconds' not in old or 'seconds' not in entry:
+            continue
+        stage, size, shape, engine, layout_scale = _key(entry)
+        label = f"{shape} {engine} x{layout_scale:g}" if shape else f"{size:g} MB"
+        print(f"  {stage:<13} {label:<16} время x{entry['seconds'] / old['seconds']:.2f}, "
+              f"RSS {entry['peak_rss_mb'] - old['peak_rss_mb']:+.0f} MB", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', help=f"размеры экспортов в MB (по умолчанию {DEFAULT_SIZES})")
+    parser.add_argument('--quick', action='store_true', help=f"только {QUICK_SIZES} MB")
+    parser.add_argument('--shapes', nargs='+', help="формы из patterns/ (по умолчанию все)")
+    parser.add_argument('--layout-scales', type=float, nargs='+', default=[1],
+                        help="масштабы холста раскладки (layout_scale, не меньше 0.5), например 1 0.5")
+    parser.add_argument('--engines', nargs='+', default=['native'],
+                        help="движки раскладки: native, wordcloud")
+    parser.add_argument('--data-dir', type=Path, default=ROOT / 'benchmarks' / '.data')
+    parser.add_argument('--output', type=Path, help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument('--baseline', type=Path, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    report = run(sizes, args.data_dir, args.shapes, args.layout_scales, args.engines)
+
+    if args.baseline:
+        compare(report, json.loads(args.baseline.read_text(encoding='utf-8')))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding='utf-8')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
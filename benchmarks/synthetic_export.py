@@ -0,0 +1,133 @@
+"""Генератор синтетических экспортов Telegram для бенчмарков.
+
+Слова берутся из русского словаря с распределением Ципфа: частые служебные
+и разговорные слова в голове, сгенерированные «редкие» слова в хвосте.
+Поле text бывает строкой, массивом сущностей и пустым (стикеры, медиа).
+Файл пишется потоково, поэтому даже экспорт на 500 MB не требует памяти.
+
+Запуск: python benchmarks/synthetic_export.py --size 50 --out result.json [--zip]
+"""
+import argparse
+import json
+import os
+import random
+import zipfile
+from datetime import datetime, timezone
+from itertools import accumulate
+from typing import Iterator
+
+COMMON_WORDS = (
+    "что это как так все она его только было мне уже вот меня ещё нет когда даже ничего "
+    "тебя тебе может надо очень хорошо сейчас потом завтра сегодня привет спасибо пожалуйста "
+    "люблю скучаю котик солнышко зайка давай будешь буду дома работа вечером утром ночью "
+    "позвони напиши понял поняла окей конечно правда просто думаю знаешь хочу можно нужно "
+    "вообще кстати кажется наверное блин короче слушай смотри сколько почему зачем куда "
+    "время деньги магазин фильм кино музыка песня друзья мама папа погода дождь снег лето "
+    "зима весна осень неделя выходные праздник подарок день рождения встреча кафе кофе чай"
+).split()
+ALPHABET = "абвгдежзийклмнопрстуфхцчшщыьэюя"
+SENDERS = ("Аня", "Максим")
+
+
+def make_vocabulary(size: int, rnd: random.Random) -> list[str]:
+    """Словарь: частые русские слова, затем сгенерированный хвост"""
+    words = list(dict.fromkeys(COMMON_WORDS))
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rnd.choices(ALPHABET, k=rnd.randint(3, 11)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def iter_messages(vocabulary_size: int = 50_000, exponent: float = 1.07,
+                  seed: int = 42) -> Iterator[dict]:
+    """Бесконечный поток сообщений в формате экспорта Telegram"""
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rnd)
+    cum_weights = list(accumulate(1 / rank ** exponent for rank in range(1, vocabulary_size + 1)))
+
+    message_id = 0
+    timestamp = 1_600_000_000
+    while True:
+        message_id += 1
+        timestamp += rnd.randint(5, 3600)
+        sender = rnd.choice(SENDERS)
+        words = rnd.choices(vocabulary, cum_weights=cum_weights, k=rnd.randint(1, 20))
+        text = ' '.join(words)
+        if rnd.random() < 0.3:
+            text = text.capitalize() + rnd.choice(('!', '?', ')', '...', ''))
+
+        kind = rnd.random()
+        if kind < 0.65:
+            entities = [{"type": "plain", "text": text}]
+        elif kind < 0.85:
+            middle = len(text) // 2
+            text = [
+                text[:middle],
+                {"type": rnd.choice(("bold", "italic", "text_link", "mention")), "text": text[middle:]},
+                " https://t.me/valentine",
+            ]
+            entities = [part if isinstance(part, dict) else {"type": "plain", "text": part} for part in text]
+        else:
+            text = ""
+            entities = []
+
+        message = {
+            "id": message_id,
+            "type": "message",
+            "date": datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+            "date_unixtime": str(timestamp),
+            "from": sender,
+            "from_id": f"user{SENDERS.index(sender) + 1}",
+            "text": text,
+            "text_entities": entities,
+        }
+        if kind >= 0.85:
+            message["media_type"] = rnd.choice(("sticker", "voice_message", "video_file"))
+            message["file"] = "(File not included. Change data exporting settings to download.)"
+        yield message
+
+
+def write_export(path: str, size_mb: float, seed: int = 42) -> int:
+    """Пишет result.json заданного размера и возвращает число сообщений"""
+    target = int(size_mb * 1024 * 1024)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{\n "name": "Аня",\n "type": "personal_chat",\n "id": 1234567,\n "messages": [\n')
+        written = 0
+        for message in iter_messages(seed=seed):
+            chunk = ('' if count == 0 else ',\n') + '  ' + json.dumps(message, ensure_ascii=False)
+            file.write(chunk)
+            written += len(chunk.encode('utf-8'))
+            count += 1
+            if written >= target:
+                break
+        file.write('\n ]\n}\n')
+    return count
+
+
+def write_zip(json_path: str, zip_path: str):
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(json_path, 'result.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=float, default=10, help="размер result.json в MB")
+    parser.add_argument('--out', default='result.json')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--zip', action='store_true', help="дополнительно упаковать в ZIP рядом")
+    args = parser.parse_args()
+
+    count = write_export(args.out, args.size, seed=args.seed)
+    print(f"{args.out}: {os.path.getsize(args.out) / 1024 / 1024:.1f} MB, сообщений {count}")
+    if args.zip:
+        zip_path = os.path.splitext(args.out)[0] + '.zip'
+        write_zip(args.out, zip_path)
+        print(f"{zip_path}: {os.path.getsize(zip_path) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
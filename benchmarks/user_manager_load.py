@@ -0,0 +1,87 @@
+"""Нагрузочный тест UserManager: шквал /start от новых пользователей.
+
+Каждый «пользователь» делает то же, что обработчик /start: is_new_user,
+add_user, is_admin. Меряется пропускная способность записей при групповом
+коммите и при коммите на каждую запись (--batch-size 1 --delay 0 — как
+было до писателя).
+
+Запуск: python benchmarks/user_manager_load.py --users 5000 --concurrency 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from app.user_manager import UserManager, WRITE_BATCH_DELAY, WRITE_BATCH_SIZE
+
+
+async def start_storm(manager: UserManager, users: int, concurrency: int) -> float:
+    """Прогоняет /start для users новых пользователей, возвращает секунды"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def start(user_id: int):
+        async with semaphore:
+            if await manager.is_new_user(user_id=user_id):
+                await manager.add_user(user_id=user_id)
+            await manager.is_admin(user_id=user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start(user_id) for user_id in range(1, users + 1)))
+    return time.perf_counter() - started
+
+
+async def run(users: int, concurrency: int, batch_size: int, delay: float, readers: int):
+    with tempfile.TemporaryDirectory(prefix='bench-users-') as tmp:
+        manager = UserManager()
+        manager.db_path = os.path.join(tmp, 'users.db')
+        manager.write_batch_size = batch_size
+        manager.write_batch_delay = delay
+        manager.readers = readers
+
+        commits = 0
+        original = manager._commit_batch
+
+        async def counting_commit(batch):
+            nonlocal commits
+            commits += 1
+            await original(batch)
+
+        manager._commit_batch = counting_commit
+        try:
+            seconds = await start_storm(manager, users, concurrency)
+            stored = len(await manager.get_users())
+        finally:
+            await manager.close()
+
+    print(f"batch={batch_size:<4} delay={delay * 1000:g} мс readers={readers}: "
+          f"{users} /start за {seconds:.2f} с — {users / seconds:,.0f} записей/с, "
+          f"коммитов {commits}, в базе {stored}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=500, help="одновременных /start")
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE)
+    parser.add_argument('--delay', type=float, default=WRITE_BATCH_DELAY, help="окно группового коммита, с")
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--compare', action='store_true', help="дополнительно прогнать коммит на каждую запись")
+    args = parser.parse_args()
+
+    async def run_all():
+        # Один цикл событий на все прогоны: UserManager — синглтон с общим замком
+        if args.compare:
+            await run(args.users, args.concurrency, 1, 0, args.readers)
+        await run(args.users, args.concurrency, args.batch_size, args.delay, args.readers)
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
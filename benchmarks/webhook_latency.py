@@ -0,0 +1,176 @@
+"""Задержка «обновление → обработчик»: long polling против webhook.
+
+Поднимает локальную заглушку Bot API (getMe, getUpdates, setWebhook,
+deleteWebhook) и подаёт ей поток обновлений с заданной частотой.
+В режиме polling бот забирает их через getUpdates, в режиме webhook
+заглушка сама шлёт POST на app.webhook (как Telegram, не больше
+--connections запросов одновременно). Меряется время от появления
+обновления до входа в обработчик, обработчик может «тормозить» (--handler-delay).
+--rtt добавляет сетевую задержку до серверов Telegram: по половине на
+запрос и ответ getUpdates, половину на доставку POST в режиме webhook.
+
+Запуск: python benchmarks/webhook_latency.py --updates 2000 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.webhook import start_webhook_server
+
+TOKEN = "123456:bench"
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+WEBHOOK_PATH = "/webhook"
+
+
+class FakeTelegram:
+    """Заглушка Bot API: очередь обновлений для getUpdates или рассылка на webhook"""
+
+    def __init__(self, rtt: float):
+        self.one_way = rtt / 2
+        self.pending: list[dict] = []
+        self.available = asyncio.Event()
+        self.emitted: dict[int, float] = {}
+
+    def ok(self, result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        await asyncio.sleep(self.one_way)
+        response = await self._call(method, params)
+        await asyncio.sleep(self.one_way)
+        return response
+
+    async def _call(self, method: str, params: dict) -> web.Response:
+        if method == 'getMe':
+            return self.ok({"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method in ('setWebhook', 'deleteWebhook'):
+            return self.ok(True)
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            self.pending = [update for update in self.pending if update['update_id'] >= offset]
+            if not self.pending:
+                self.available.clear()
+                try:
+                    await asyncio.wait_for(self.available.wait(), float(params.get('timeout') or 0) or 0.01)
+                except asyncio.TimeoutError:
+                    pass
+            return self.ok(self.pending[:100])
+        return self.ok(True)
+
+    def make_update(self, update_id: int) -> dict:
+        user = {"id": 1000 + update_id % 500, "is_bot": False, "first_name": "Аня"}
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": "ping",
+                "chat": {"id": user["id"], "type": "private"}, "from": user,
+            },
+        }
+
+    async def feed_polling(self, count: int, rate: float):
+        for update_id in range(1, count + 1):
+            self.pending.append(self.make_update(update_id))
+            self.emitted[update_id] = time.perf_counter()
+            self.available.set()
+            await asyncio.sleep(1 / rate)
+
+    async def feed_webhook(self, count: int, rate: float, connections: int):
+        url = f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+        semaphore = asyncio.Semaphore(connections)
+        async with ClientSession() as session:
+            async def post(update: dict):
+                async with semaphore:
+                    self.emitted[update['update_id']] = time.perf_counter()
+                    await asyncio.sleep(self.one_way)
+                    async with session.post(url, data=json.dumps(update),
+                                            headers={'Content-Type': 'application/json'}) as response:
+                        await response.read()
+
+            tasks = []
+            for update_id in range(1, count + 1):
+                tasks.append(asyncio.create_task(post(self.make_update(update_id))))
+                await asyncio.sleep(1 / rate)
+            await asyncio.gather(*tasks)
+
+
+async def measure(mode: str, count: int, rate: float, handler_delay: float, connections: int,
+                  rtt: float) -> list[float]:
+    fake = FakeTelegram(rtt)
+    api = web.Application()
+    api.router.add_route('POST', '/bot{token}/{method}', fake.handle)
+    api_runner = web.AppRunner(api, access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, '127.0.0.1', API_PORT).start()
+
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}")))
+    dp = Dispatcher()
+    handled: dict[int, float] = {}
+    done = asyncio.Event()
+
+    @dp.message()
+    async def on_message(message: types.Message):
+        handled[message.message_id] = time.perf_counter()
+        if len(handled) == count:
+            done.set()
+        await asyncio.sleep(handler_delay)
+
+    try:
+        if mode == 'polling':
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+            await asyncio.sleep(0.2)
+            await fake.feed_polling(count, rate)
+            await asyncio.wait_for(done.wait(), 60)
+            await dp.stop_polling()
+            await polling
+        else:
+            runner = await start_webhook_server(dp, bot, '127.0.0.1', WEBHOOK_PORT, WEBHOOK_PATH)
+            await fake.feed_webhook(count, rate, connections)
+            await asyncio.wait_for(done.wait(), 60)
+            await runner.cleanup()
+    finally:
+        await bot.session.close()
+        await api_runner.cleanup()
+
+    return [(handled[i] - fake.emitted[i]) * 1000 for i in handled]
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help="обновлений в секунду")
+    parser.add_argument('--handler-delay', type=float, default=0.5, help="время работы обработчика, с")
+    parser.add_argument('--connections', type=int, default=40, help="одновременных POST на webhook")
+    parser.add_argument('--rtt', type=float, default=0.05, help="сетевой RTT до Telegram, с")
+    parser.add_argument('--modes', nargs='+', default=['polling', 'webhook'])
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        latencies = asyncio.run(measure(mode, args.updates, args.rate, args.handler_delay, args.connections,
+                                       args.rtt))
+        print(f"{mode:<8} {len(latencies)} обновлений: p50 {percentile(latencies, 0.5):.1f} мс, "
+              f"p99 {percentile(latencies, 0.99):.1f} мс, среднее {statistics.mean(latencies):.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
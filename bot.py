@@ -6,38 +6,55 @@ from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
-from app.user_manager import UserManager
+from app.user_manager import user_manager
 from app.handlers.generate_photo import register_photo_handlers
 from app.handlers.admin_handler import register_admin_handlers
 from app.handlers.profile import register_profile_handlers
-from app.reset_limits import start_nightly_reset_scheduler
+from app import parallel_count
+from get_photo import get_generator
+from app.render_pool import render_pool
+from app.broadcast import broadcaster
+from app.fsm_storage import SQLiteStorage
+from app.job_queue import job_queue
+from app.workspace import workspaces
+from app.webhook import run_webhook
 from app.utils.logger import setup_logging, get_logger
-from config import BOT_TOKEN
-
-setup_logging(log_level=os.getenv("LOG_LEVEL", "INFO"))
+from config import (BOT_TOKEN, BOT_PRIMARY, TELEGRAM_API_URL, WEBHOOK_HOST, WEBHOOK_PATH,
+                    WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
 
 logger = get_logger(__name__)
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-dp = Dispatcher()
 
-user_manager = UserManager()
 
-register_photo_handlers(dp, user_manager)
-register_admin_handlers(dp, user_manager)
-register_profile_handlers(dp, user_manager)
+# Бот и диспетчер создаются только при запуске: воркеры пулов (spawn) импортируют
+# bot.py заново как __mp_main__, и на уровне модуля здесь остаются только импорты
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    return Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+
 
-start_nightly_reset_scheduler(user_manager=user_manager, reset_time="00:00")
+def create_dispatcher() -> Dispatcher:
+    # Состояния в общей базе: их видят все процессы бота и они переживают перезапуск
+    dp = Dispatcher(storage=SQLiteStorage(user_manager))
+    dp.message.register(start, Command("start"))
+    register_photo_handlers(dp, user_manager)
+    register_admin_handlers(dp, user_manager)
+    register_profile_handlers(dp, user_manager)
+    return dp
 
 
-@dp.message(Command("start"))
-async def main(message: types.Message):
+async def start(message: types.Message):
     """Главное меню"""
     logger.info(f"Получена команда /start от пользователя {message.from_user.id}")
     user_id = int(message.chat.id)
     if await user_manager.is_new_user(user_id=user_id):
         await user_manager.add_user(user_id=user_id)
+    else:
+        # /start после блокировки — снова получает рассылки
+        await user_manager.set_blocked(user_id=user_id, blocked=False)
     
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -70,16 +87,41 @@ async def main(message: types.Message):
 
 async def main_async():
     """Основная асинхронная функция запуска бота"""
+    bot = create_bot()
+    dp = create_dispatcher()
     try:
         logger.info("Запуск бота...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        await asyncio.to_thread(get_generator().preload_masks, 'patterns')
+        await render_pool.start()
+        await workspaces.start()
+        await job_queue.start(bot)
+        if BOT_PRIMARY:
+            await broadcaster.resume(bot)
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET, register=BOT_PRIMARY)
+        elif BOT_PRIMARY:
+            # Telegram не отдаёт getUpdates, пока зарегистрирован webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        else:
+            # getUpdates может читать только один процесс — остальные лишь выполняют задачи из очереди
+            logger.info("Процесс запущен только для генераций из общей очереди")
+            await asyncio.Event().wait()
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {type(e).__name__}: {e}")
     finally:
+        await job_queue.close()
+        await workspaces.close()
+        parallel_count.shutdown()
+        await render_pool.close()
+        await broadcaster.close()
+        await user_manager.close()
         await bot.session.close()
 
 
 if __name__ == "__main__":
+    setup_logging(log_level=os.getenv("LOG_LEVEL", "INFO"))
     try:
         asyncio.run(main_async())
     except KeyboardInterrupt:
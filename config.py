@@ -5,4 +5,18 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден! Установите переменную окружения BOT_TOKEN или создайте .env файл с BOT_TOKEN=ваш_токен")
\ No newline at end of file
+    raise ValueError("BOT_TOKEN не найден! Установите переменную окружения BOT_TOKEN или создайте .env файл с BOT_TOKEN=ваш_токен")
+
+# Режим получения обновлений: long polling (по умолчанию) или webhook,
+# если задан публичный адрес WEBHOOK_URL (без пути)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Основной процесс получает обновления (polling или регистрация webhook) и продолжает
+# рассылки; дополнительные процессы запускаются с BOT_PRIMARY=0: за прокси они тоже
+# принимают webhook, а в режиме polling только выполняют задачи из общей очереди
+BOT_PRIMARY = os.getenv("BOT_PRIMARY", "1") != "0"
+# Альтернативный Bot API сервер (локальный telegram-bot-api или заглушка для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
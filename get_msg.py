@@ -1,6 +1,22 @@
+import io
+import os
 import json
 import re
 from collections import Counter
+from itertools import chain
+
+from app.tokenizer import count_texts, message_text
+from app.parallel_count import PARALLEL_THRESHOLD, count_texts_parallel
+from app.heavy_hitters import SpaceSaving
+
+TOP_WORDS = 200
+CHUNK_SIZE = 64 * 1024
+APPROXIMATE_COUNT = os.getenv("APPROXIMATE_WORD_COUNT", "0") == "1"
+
+_MESSAGES_KEY = re.compile(r'"messages"\s*:\s*\[')
+_SEPARATORS = ' \t\n\r,'
+_json_decoder = json.JSONDecoder()
+
 
 def get_data(file_name):
     try:
@@ -12,36 +28,129 @@ def get_data(file_name):
         return None
 
 
-def get_all_msg(file_name=None):
-    
+def _open_text(source):
+    """Открывает путь или файловый объект как текстовый поток UTF-8"""
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        return open(source, "r", encoding="utf-8")
+    if isinstance(source.read(0), bytes):
+        return io.TextIOWrapper(source, encoding="utf-8")
+    return source
+
+
+def iter_messages(source, chunk_size=CHUNK_SIZE):
+    """Потоково отдаёт сообщения экспорта по одному, не загружая весь файл в память"""
+    file = _open_text(source)
+    try:
+        buf = ""
+        while True:
+            match = _MESSAGES_KEY.search(buf)
+            if match:
+                buf, pos = buf[match.end():], 0
+                break
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            # Хвост оставляем на случай, если ключ разрезан границей чанка
+            buf = buf[-32:] + chunk
+
+        read_size = chunk_size
+        while True:
+            while pos < len(buf) and buf[pos] in _SEPARATORS:
+                pos += 1
+
+            if pos < len(buf):
+                if buf[pos] == ']':
+                    return
+                try:
+                    msg, pos = _json_decoder.raw_decode(buf, pos)
+                    read_size = chunk_size
+                    yield msg
+                    continue
+                except json.JSONDecodeError:
+                    # Сообщение обрезано границей чанка — дочитываем
+                    pass
+
+            chunk = file.read(read_size)
+            if not chunk:
+                raise json.JSONDecodeError("Неожиданный конец файла", buf, pos)
+            buf = buf[pos:] + chunk
+            pos = 0
+            read_size = min(read_size * 2, 16 * chunk_size)
+    finally:
+        if file is not source:
+            file.close()
+
+
+def _source_size(source):
+    """Размер экспорта в байтах, если его можно узнать без чтения"""
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        return os.path.getsize(source)
+    raw = getattr(source, 'raw', source)
+    if getattr(raw, 'file_size', None) is not None:
+        return raw.file_size
+    try:
+        return os.fstat(source.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def count_words(messages, parallel=False, approximate=False):
+    """Считает слова в потоке сообщений, возвращает первое сообщение и счётчик.
+
+    approximate=True заменяет точный Counter на SpaceSaving с фиксированной памятью.
+    """
+    messages = iter(messages)
+    first = next(messages, None)
+    if first is None:
+        return None, Counter()
+
+    count = count_texts_parallel if parallel else count_texts
+    counter = SpaceSaving() if approximate else Counter()
+    count(chain((first,), messages), counter)
+    return message_text(first), counter
+
+
+def get_all_msg_stream(source, parallel=None, approximate=APPROXIMATE_COUNT):
+    """Потоковый вариант get_all_msg: память не зависит от размера экспорта.
+
+    parallel=None включает подсчёт в пуле процессов для экспортов больше PARALLEL_THRESHOLD.
+    """
+    try:
+        if parallel is None:
+            size = _source_size(source)
+            parallel = size is not None and size > PARALLEL_THRESHOLD
+        first_msg, counter = count_words(iter_messages(source), parallel=parallel, approximate=approximate)
+    except FileNotFoundError:
+        print("Файл не найден")
+        print("Данные не найдены, возвращаем пустые значения")
+        return None, []
+
+    if first_msg is None:
+        print("Структура данных некорректна или сообщения отсутствуют")
+        return None, []
+
+    return first_msg, counter.most_common(TOP_WORDS)
+
+
+def get_all_msg(file_name=None, stream=False):
+
     if not file_name:
         print("Ошибка")
         return None, None
-    
+
+    if stream:
+        return get_all_msg_stream(file_name)
+
     data = get_data(file_name)
-    
+
     if data is None:
         print("Данные не найдены, возвращаем пустые значения")
         return None, []
-    
+
     if "messages" not in data or not data["messages"]:
         print("Структура данных некорректна или сообщения отсутствуют")
         return None, []
-    
-    all_words = []
-    first_msg = data["messages"][0]["text"] if data["messages"][0].get("text") else ""
-    
-    for msg in data["messages"]:
-        if isinstance(msg.get("text"), str):
-            text = msg["text"].strip()
-            if text and not any(tech_word in text.lower() for tech_word in 
-                              ['document_id', 'sticker', 'video_file', 'custom_emoji']):
-                
-                clean_text = re.sub(r'[^а-яё\s]', ' ', text.lower())
-                words = clean_text.split()
-                filtered_words = [word for word in words if len(word) >= 3]
-                all_words.extend(filtered_words)
-
-    counter = Counter(all_words)
-    most_common_150 = counter.most_common(200)
-    return first_msg, most_common_150
\ No newline at end of file
+
+    first_msg, counter = count_words(data["messages"])
+    most_common_150 = counter.most_common(TOP_WORDS)
+    return first_msg, most_common_150
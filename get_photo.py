@@ -1,20 +1,80 @@
 
+import io
 import os
 import random
+import threading
 from typing import List, Tuple, Dict, Optional
 from collections import Counter
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+
+from app.layout_engine import LayoutEngine
+from app.mask_cache import mask_cache
+from app.pattern_catalog import get_catalog
 
 try:
     from wordcloud import WordCloud as BaseWordCloud, STOPWORDS, random_color_func
+    from wordcloud.wordcloud import FONT_PATH as WORDCLOUD_FONT_PATH
     WORDCLOUD_AVAILABLE = True
     print("✓ Библиотека wordcloud успешно загружена")
 except ImportError as e:
     WORDCLOUD_AVAILABLE = False
+    WORDCLOUD_FONT_PATH = None
     print(f"Ошибка: wordcloud не установлен. Установите через: pip install wordcloud")
 
 
+DEFAULT_CONFIG = {
+    'width': 600,
+    'height': 600,
+    # Итоговое изображение в scale раз больше холста
+    'scale': 1,
+    # Раскладка считается на холсте в layout_scale раз меньше и затем
+    # отрисовывается в полном размере; 1 — раскладка в полном размере.
+    # Не меньше MIN_LAYOUT_SCALE
+    'layout_scale': 1,
+    'min_font_size': 6,
+    'max_font_size': 100,
+    'min_spacing': 1,
+    'max_rotation': 45,
+    # 'native' — раскладка app.layout_engine, 'wordcloud' — библиотека wordcloud
+    'engine': 'native',
+    # Сколько слов (с повторами) размещает native-движок
+    'max_words': 1000,
+    'patterns_dir': 'patterns',
+    'output_dir': 'outputs',
+    'font_path': None,
+    # None — прозрачный фон
+    'background_color': None,
+}
+
+# Быстрое превью: тот же паттерн и слова на маленьком холсте. Фон белый,
+# потому что превью уходит фотографией, а Telegram не сохраняет прозрачность
+PREVIEW_CONFIG = {
+    **DEFAULT_CONFIG,
+    'width': 320,
+    'height': 320,
+    'min_font_size': 5,
+    'max_font_size': 60,
+    'max_words': 300,
+    'background_color': 'white',
+}
+
+# При меньшем layout_scale шрифты раскладки в 2-3 px и округление размеров
+# дают наложение букв после увеличения (на «Сердце» при 0.35 — до 13 px)
+MIN_LAYOUT_SCALE = 0.5
+
+# Ограничение размера PNG; больше — кодируем с палитрой
+MAX_PNG_SIZE = 2 * 1024 * 1024
+PALETTE_COLORS = 128
+# Размер PNG облака слов определяют сглаженные края букв (0 < alpha < 255):
+# ~2.7-3.6 байта на такой пиксель при любом масштабе; берём с запасом
+BYTES_PER_EDGE_PIXEL = 4
+
+# Готовые генераторы по конфигу, общие на процесс
+_generators: Dict[str, 'DenseWordCloudGenerator'] = {}
+_cache_lock = threading.Lock()
+
+
 class DenseWordCloudGenerator:
     """Генератор плотных облаков слов с поддержкой пользовательских форм"""
     
@@ -22,18 +82,23 @@ class DenseWordCloudGenerator:
         self.config = config
         self.width = config.get('width', 1200)
         self.height = config.get('height', 1200)
+        self.scale = config.get('scale', 1)
+        self.layout_scale = config.get('layout_scale', 1)
+        if self.layout_scale < MIN_LAYOUT_SCALE:
+            raise ValueError(f"layout_scale должен быть не меньше {MIN_LAYOUT_SCALE}, получено {self.layout_scale}")
         self.min_font_size = config.get('min_font_size', 6)
         self.max_font_size = config.get('max_font_size', 100)
         self.min_spacing = config.get('min_spacing', 1)
         self.max_rotation = config.get('max_rotation', 45)
         self.color_schemes = config.get('color_schemes', self._get_default_color_schemes())
         self.font_path = config.get('font_path', None)
+        self.engine = config.get('engine', 'native')
+        self.max_words = config.get('max_words', 1000)
+        self.background_color = config.get('background_color', None)
         
         os.makedirs(config.get('patterns_dir', 'patterns'), exist_ok=True)
         os.makedirs(config.get('output_dir', 'outputs'), exist_ok=True)
         
-        self._init_fonts()
-        
     def _get_default_color_schemes(self) -> List[List[str]]:
         """Возвращает наборы цветовых схем по умолчанию"""
         return [
@@ -45,33 +110,25 @@ class DenseWordCloudGenerator:
             ['#a8edea', '#fed6e3', '#d299c2', '#fef9d7', '#667eea'],  # Нежные пастели
         ]
     
-    def _init_fonts(self):
-        """Инициализирует шрифты для разных размеров"""
-        self.fonts = {}
-        try:
-            font_to_use = self.font_path
-            
-            for size in range(self.min_font_size, self.max_font_size + 1, 2):
-                if font_to_use and os.path.exists(font_to_use):
-                    try:
-                        self.fonts[size] = ImageFont.truetype(font_to_use, size)
-                    except:
-                        self.fonts[size] = ImageFont.load_default()
-                else:
-                    # Пробуем системные шрифты
-                    try:
-                        self.fonts[size] = ImageFont.truetype("arial.ttf", size)
-                    except:
-                        try:
-                            self.fonts[size] = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", size)
-                        except:
-                            self.fonts[size] = ImageFont.load_default()
-        except Exception as e:
-            print(f"Предупреждение: Не удалось загрузить шрифты: {e}")
-            # Используем шрифт по умолчанию
-            for size in range(self.min_font_size, self.max_font_size + 1, 2):
-                self.fonts[size] = ImageFont.load_default()
-    
+    @property
+    def canvas_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def layout_size(self) -> Tuple[int, int]:
+        """Размер холста, на котором ищутся позиции слов"""
+        return (max(1, round(self.width * self.layout_scale)),
+                max(1, round(self.height * self.layout_scale)))
+
+    def load_mask(self, pattern_path: str) -> np.ndarray:
+        """Маска паттерна, вписанная в холст раскладки"""
+        return mask_cache.get(pattern_path, self.layout_size)
+
+    def preload_masks(self, patterns_dir: Optional[str] = None) -> int:
+        """Заранее готовит маски всех паттернов под размер холста раскладки"""
+        patterns_dir = patterns_dir or self.config.get('patterns_dir', 'patterns')
+        return get_catalog(patterns_dir).preload(self.layout_size)
+
     def _expand_word_list(self, words: List[str], target_count: int) -> List[str]:
         """Расширяет список слов до целевого количества"""
         if len(words) >= target_count:
@@ -94,51 +151,40 @@ class DenseWordCloudGenerator:
             return random.choice(color_scheme)
         return color_func
 
-    def generate_custom_shape_wordcloud(self, words: List[str], pattern_path: str, 
-                                    output_path: str) -> bool:
-        """Генератор облака слов с оптимизацией размера файла"""
-        if not WORDCLOUD_AVAILABLE:
-            print("Ошибка: Библиотека wordcloud недоступна")
-            return False
-        
+    def build_wordcloud(self, words: List[str], mask: np.ndarray, seed: Optional[int] = None):
+        """Раскладывает слова по маске; у результата есть to_image() для отрисовки.
 
-        expanded_words = self._expand_word_list(words, target_count=200)
-        
-        try:
-            img = Image.open(pattern_path)
-            
-            if img.mode == 'RGBA':
-                arr = np.array(img)
-                alpha = arr[:,:,3]
-                mask = np.where(alpha == 255, 0, 255).astype(np.uint8)
-                        
-            else:
-                gray = np.array(img.convert('L'))
-                mask = np.where(gray == 255, 0, 255).astype(np.uint8)
-            
-        except Exception as e:
-            print(f"Ошибка загрузки маски из {pattern_path}: {e}")
-            return False
-        
+        seed фиксирует выбор цветовой схемы (превью и полный рендер в одних цветах).
+        """
         # Выбираем цветовую схему
-        color_scheme = random.choice(self.color_schemes)
+        color_scheme = (random if seed is None else random.Random(seed)).choice(self.color_schemes)
+        if self.engine == 'native':
+            return self._build_native(words, mask, color_scheme)
+
+        expanded_words = self._expand_word_list(words, target_count=200)
+
         color_func = self._create_custom_color_func(color_scheme)
         
         # Создаем словарь частот
         word_freq = Counter(expanded_words)
+        # Размер холста задаёт маска (она уже вписана в холст раскладки).
+        # Размеры шрифтов уменьшаются вместе с холстом, а to_image рисует
+        # сохранённую раскладку в масштабе scale / layout_scale.
+        height, width = mask.shape
         wordcloud_config = {
-            'width': self.width,
-            'height': self.height,
+            'width': width,
+            'height': height,
+            'scale': self.scale / self.layout_scale,
             'mask': mask,
             'max_words': len(expanded_words),
-            'min_font_size': self.min_font_size,
-            'max_font_size': self.max_font_size,
+            'min_font_size': max(1, round(self.min_font_size * self.layout_scale)),
+            'max_font_size': max(1, round(self.max_font_size * self.layout_scale)),
             'relative_scaling': 0.5,
             'colormap': None,
             'color_func': color_func,
             'prefer_horizontal': 0.8,
             'margin': 0,
-            'background_color': None,
+            'background_color': self.background_color,
             'mode': 'RGBA',
             'font_path': self.font_path,
             'random_state': 42,
@@ -151,126 +197,166 @@ class DenseWordCloudGenerator:
             'contour_color': None,
         }
         
+        wordcloud = BaseWordCloud(**wordcloud_config)
+        wordcloud.generate_from_frequencies(word_freq)
+        return wordcloud
+
+    def _build_native(self, words: List[str], mask: np.ndarray, color_scheme: List[str]):
+        """Раскладка собственным движком: повторяет слова, пока остаётся место"""
+        color_func = self._create_custom_color_func(color_scheme)
+        engine = LayoutEngine(
+            # Тот же шрифт, что использует wordcloud, если свой не задан
+            font_path=self.font_path or WORDCLOUD_FONT_PATH,
+            min_font_size=max(1, round(self.min_font_size * self.layout_scale)),
+            max_font_size=max(1, round(self.max_font_size * self.layout_scale)),
+            margin=self.min_spacing,
+            prefer_horizontal=0.8,
+            relative_scaling=0.5,
+            max_words=self.max_words,
+            scale=self.scale / self.layout_scale,
+            background_color=self.background_color,
+            random_state=42,
+        )
+        return engine.layout(Counter(words), mask, color_func)
+
+    def render_png(self, words: List[str], pattern_path: str, seed: Optional[int] = None) -> Optional[bytes]:
+        """Рисует облако слов в форме паттерна и возвращает PNG в байтах"""
+        if self.engine == 'wordcloud' and not WORDCLOUD_AVAILABLE:
+            print("Ошибка: Библиотека wordcloud недоступна")
+            return None
+        
         try:
-            wordcloud = BaseWordCloud(**wordcloud_config)
-            wordcloud.generate_from_frequencies(word_freq)
+            mask = self.load_mask(pattern_path)
+        except Exception as e:
+            print(f"Ошибка загрузки маски из {pattern_path}: {e}")
+            return None
+        
+        try:
+            wordcloud = self.build_wordcloud(words, mask, seed=seed)
             image = wordcloud.to_image()
 
-            return self._optimize_and_save_image(image, output_path)
+            return self.encode_png(image)
             
         except Exception as e:
             print(f"Ошибка при создании облака слов: {e}")
+            return None
+
+    def generate_custom_shape_wordcloud(self, words: List[str], pattern_path: str, 
+                                    output_path: str) -> bool:
+        """Генератор облака слов с сохранением PNG в файл"""
+        data = self.render_png(words, pattern_path)
+        if data is None:
             return False
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return True
 
-    def _optimize_and_save_image(self, image: Image.Image, output_path: str) -> bool:
-        """Оптимизирует и сохраняет изображение с минимальным размером файла"""
-        try:
-            image.save(
-                output_path, 
-                'PNG', 
-                optimize=True,
-                compress_level=6,
-            )
-            file_size = os.path.getsize(output_path)
-            print(f"Размер файла после сохранения: {file_size} байт ({file_size/1024:.1f} KB)")
-            
-            if file_size > 2 * 1024 * 1024:
-                print("Файл слишком большой, применяем дополнительную оптимизацию...")
-                return self._further_optimize_image(image, output_path)
-            
+    def _needs_palette(self, image: Image.Image) -> bool:
+        """Решает до кодирования, нужна ли палитра.
+
+        Если цветов не больше PALETTE_COLORS, палитра ничего не теряет.
+        Иначе размер PNG оценивается по числу полупрозрачных пикселей.
+        """
+        if image.getcolors(PALETTE_COLORS) is not None:
             return True
-            
-        except Exception as e:
-            print(f"Ошибка при сохранении изображения: {e}")
+        if image.mode != 'RGBA':
             return False
+        edges = sum(image.getchannel('A').histogram()[1:255])
+        return edges * BYTES_PER_EDGE_PIXEL > MAX_PNG_SIZE
+
+    def encode_png(self, image: Image.Image) -> bytes:
+        """Кодирует изображение в PNG в памяти, как правило за один проход"""
+        palette = self._needs_palette(image)
+        data = self._encode(image, palette)
+
+        if not palette and len(data) > MAX_PNG_SIZE:
+            # Оценка не сработала — приходится кодировать второй раз
+            print("Файл слишком большой, применяем дополнительную оптимизацию...")
+            data = self._encode(image, palette=True)
+
+        print(f"Размер PNG: {len(data)} байт ({len(data)/1024:.1f} KB)")
+        return data
+
+    @staticmethod
+    def _encode(image: Image.Image, palette: bool) -> bytes:
+        if palette:
+            image = image.quantize(PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        buffer = io.BytesIO()
+        # optimize=True перебирает настройки zlib: в 5-6 раз дольше ради ~3% размера
+        image.save(buffer, 'PNG', compress_level=9 if palette else 6)
+        return buffer.getvalue()
+
+def get_generator(config: Optional[Dict] = None) -> DenseWordCloudGenerator:
+    """Возвращает долгоживущий генератор для конфига, создавая его один раз на процесс"""
+    config = DEFAULT_CONFIG if config is None else config
+    key = repr(sorted(config.items()))
+    generator = _generators.get(key)
+    if generator is None:
+        generator = DenseWordCloudGenerator(config)
+        with _cache_lock:
+            generator = _generators.setdefault(key, generator)
+    return generator
 
-    def _further_optimize_image(self, image: Image.Image, output_path: str) -> bool:
-        try:
-            if image.mode == 'RGBA':
-                image = image.convert('RGBA')
-                
-                temp_image = image.convert('RGB')
-                temp_image = temp_image.convert('P', palette=Image.ADAPTIVE, colors=128)
-                alpha = image.split()[-1]
-                mask = Image.eval(alpha, lambda a: 255 if a > 0 else 0)
-                temp_image.putalpha(mask)
-                
-                image = temp_image
-            
-            image.save(
-                output_path,
-                'PNG',
-                optimize=True,
-                compress_level=9,
-            )
-            
-            final_size = os.path.getsize(output_path)
-            print(f"Размер после дополнительной оптимизации: {final_size} байт ({final_size/1024:.1f} KB)")
-            
-            return True
-        
-        except Exception as e:
-            print(f"Ошибка дополнительной оптимизации: {e}")
-            try:
-                image.save(output_path, 'PNG', optimize=True, compress_level=9)
-                return True
-            except:
-                return False
 
 def get_words_from_messages(file_name) -> List[str]:
     """Получает слова из сообщений используя существующий модуль"""
     try:
         from get_msg import get_all_msg
-        first_msg, most_common_words = get_all_msg(file_name)
+        first_msg, most_common_words = get_all_msg(file_name, stream=True)
         words = [word for word, count in most_common_words]
         print(f"Загружено {len(words)} слов из сообщений (все доступные слова)")
         return words, first_msg
         
     except Exception as e:
         print(f"Ошибка загрузки слов из сообщений: {e}")
+        return None, None
+
+def render_pattern(words: List[str], pattern: str, preview: bool = False,
+                   seed: Optional[int] = None) -> Optional[bytes]:
+    """Рисует облако слов в форме паттерна и возвращает PNG в байтах"""
+    config = PREVIEW_CONFIG if preview else DEFAULT_CONFIG
+
+    generator = get_generator(config)
+    # pattern — точное имя файла паттерна (как в каталоге), с расширением
+    entry = get_catalog(config['patterns_dir']).get(pattern)
+    if entry is None:
+        print(f"❌ Ошибка: паттерн не найден {pattern}")
         return None
 
-def main(user_id=0, pattern=None, file=None):
+    data = generator.render_png(words, entry.path, seed=seed)
+    if data is None:
+        print(f"❌ Ошибка при создании облака слов в форме '{pattern}'")
+        return None
+
+    print(f"✅ Облако слов создано: {pattern}")
+    return data
+
+
+def main(user_id=0, pattern=None, file=None, output_dir=None):
     """Основная функция программы — генерация облака слов"""
     if not pattern:
         print("❌ Ошибка: не указан паттерн")
         return None, None
-
-    pattern = f"{pattern}.png"
-    
-    config = {
-        'width': 600,
-        'height': 600,
-        'min_font_size': 6,
-        'max_font_size': 100,
-        'min_spacing': 1,
-        'max_rotation': 45,
-        'patterns_dir': 'patterns',
-        'output_dir': 'outputs',
-        'font_path': None,
-    }
-
-    os.makedirs(config['output_dir'], exist_ok=True)
+    catalog = get_catalog(DEFAULT_CONFIG['patterns_dir'])
+    entry = catalog.find(pattern)
+    if entry is None:
+        print(f"❌ Ошибка: паттерн {pattern} не найден или неоднозначен, доступны: "
+              f"{', '.join(p.file for p in catalog.patterns())}")
+        return None, None
 
     words, first_msg = get_words_from_messages(file_name=file)
     if words is None:
         print("Ошибка загрузки слов")
         return None, None
 
-    generator = DenseWordCloudGenerator(config)
-    pattern_path = os.path.join(config['patterns_dir'], pattern)
-    
-    if not os.path.exists(pattern_path):
-        print(f"❌ Ошибка: файл паттерна не найден {pattern_path}")
-        return None, first_msg
-
-    output_filename = f"{os.path.splitext(pattern)[0]}_user_id-{user_id}.png"
-    output_path = os.path.join(config['output_dir'], output_filename)
-
-    success = generator.generate_custom_shape_wordcloud(words, pattern_path, output_path)
-    if not success:
-        print(f"❌ Ошибка при создании облака слов в форме '{pattern}'")
+    data = render_pattern(words, entry.file)
+    if data is None:
         return None, first_msg
 
-    print(f"✅ Облако слов создано: {output_path}")
-    return output_path, first_msg
\ No newline at end of file
+    # output_dir — например, рабочий каталог задачи, чтобы параллельные запуски не перезаписывали файл
+    output_dir = output_dir or DEFAULT_CONFIG['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{entry.name}_user_id-{user_id}.png")
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return output_path, first_msg